@@ -0,0 +1,156 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from spotify_cache import ResponseCache
+
+
+SEARCH_TTL = 60 * 60
+TOP_TRACKS_TTL = 6 * 60 * 60
+MAX_CACHED_SEARCHES = 5000
+MAX_INDEXED_ARTISTS = 20000
+# Prefix matches against known artists only for queries at least this long
+MIN_PREFIX_LENGTH = 3
+
+
+def normalize(query):
+    return ' '.join(query.lower().split())
+
+
+class ArtistIndex:
+    """Artists resolved so far, searchable by exact or prefix match on their normalized name.
+
+    Bounded like the search cache: least recently used artists are evicted past max_entries,
+    and entries expire after ttl so popularity / followers don't go stale.
+    """
+
+    def __init__(self, max_entries=MAX_INDEXED_ARTISTS, ttl=SEARCH_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # name -> (expires_at, artist), oldest used first
+        self._artists = OrderedDict()
+        self._names = []
+        self._lock = threading.Lock()
+
+    def _remove(self, name):
+        # Called with the lock held
+        del self._artists[name]
+        del self._names[bisect.bisect_left(self._names, name)]
+
+    def add(self, artist):
+        name = normalize(artist['name'])
+        with self._lock:
+            if name not in self._artists:
+                bisect.insort(self._names, name)
+            self._artists[name] = (time.monotonic() + self.ttl, artist)
+            self._artists.move_to_end(name)
+            while len(self._artists) > self.max_entries:
+                self._remove(next(iter(self._artists)))
+
+    def _get(self, name, now):
+        # Called with the lock held, drops the entry once it expired
+        entry = self._artists.get(name)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            self._remove(name)
+            return None
+        self._artists.move_to_end(name)
+        return entry[1]
+
+    def exact(self, query):
+        with self._lock:
+            return self._get(query, time.monotonic())
+
+    def prefix(self, query):
+        """Most popular known artist whose name starts with query, when query stops inside a word of
+        that name ("drak" for "drake bell"). A whole word ("drake") could be an artist of its own."""
+        now = time.monotonic()
+        with self._lock:
+            start = bisect.bisect_left(self._names, query)
+            names = []
+            for name in self._names[start:]:
+                if not name.startswith(query):
+                    break
+                if len(name) > len(query) and name[len(query)] != ' ':
+                    names.append(name)
+            matches = [artist for artist in (self._get(name, now) for name in names) if artist is not None]
+        return max(matches, key=lambda artist: artist.get('popularity', 0), default=None)
+
+    def __len__(self):
+        return len(self._artists)
+
+
+class ArtistSearch:
+    """Artist search shared by every session of the app.
+
+    Answers from an LRU+TTL cache keyed on the normalized query and market, then from the local
+    index of artists seen in earlier results, and only then asks Spotify. Identical lookups running at the same time share one request.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_SEARCHES):
+        self.cache = ResponseCache(max_entries)
+        self.index = ArtistIndex()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _fetch_once(self, key, ttl, fetch):
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            # Another thread may have just finished the same fetch
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = fetch()
+            self.cache.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def find_artist(self, query, fetch, market='US'):
+        """Best matching artist for query, or None. fetch() does the real search and returns a list of artists."""
+        query = normalize(query)
+        if not query:
+            return None
+
+        # The full query was searched before, its own results win over other queries' artists
+        results = self.cache.get(('search', query, market))
+        if results is not None:
+            return results[0] if results else None
+
+        artist = self.index.exact(query)
+        if artist is None and len(query) >= MIN_PREFIX_LENGTH:
+            artist = self.index.prefix(query)
+        if artist is not None:
+            return artist
+
+        results = self._fetch_once(('search', query, market), SEARCH_TTL, fetch)
+        for result in results:
+            self.index.add(result)
+        return results[0] if results else None
+
+    def top_tracks(self, artist_id, fetch, market='US'):
+        return self._fetch_once(('top_tracks', artist_id, market), TOP_TRACKS_TTL, fetch)
+
+
+# One instance per process, shared across Streamlit sessions and reruns
+artist_search = ArtistSearch()
@@ -0,0 +1,230 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from requests.adapters import HTTPAdapter
+
+
+def _ms(timestamp):
+    fmt = '%Y-%m-%dT%H:%M:%S.%fZ' if '.' in timestamp else '%Y-%m-%dT%H:%M:%SZ'
+    return int(datetime.strptime(timestamp, fmt).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class FakeSpotify:
+    """Local stand-in for api.spotify.com / accounts.spotify.com serving fixture data.
+
+    Every request sleeps `latency` seconds, and with probability `rate_limit_probability`
+    is answered with a 429 and a Retry-After header instead. Calls, 429s and response bytes
+    are counted so a benchmark can report them.
+    """
+
+    def __init__(self, fixtures, latency=0.0, rate_limit_probability=0.0, retry_after=1, seed=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._artists = {artist['id']: artist for artist in fixtures['artists']}
+        self._tracks_by_artist = {}
+        for track in fixtures['tracks']:
+            self._tracks_by_artist.setdefault(track['artists'][0]['id'], []).append(track)
+        self._played_ms = [_ms(item['played_at']) for item in fixtures['recently_played']]
+        self.server = None
+        self.reset_stats()
+
+    # -- stats --
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.rate_limited = 0
+            self.bytes_sent = 0
+            self.calls_by_endpoint = Counter()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'rate_limited': self.rate_limited, 'bytes': self.bytes_sent,
+                    'by_endpoint': dict(self.calls_by_endpoint)}
+
+    # -- server --
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake._handle(self)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                fake._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _send(self, handler, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+        with self._lock:
+            self.bytes_sent += len(payload)
+
+    def _handle(self, handler):
+        url = urlparse(handler.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/')
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            endpoint = re.sub(r'/artists/[^/]+', '/artists/{id}', path) if path != '/v1/artists' else path
+            self.calls_by_endpoint[endpoint] += 1
+            limited = self._rng.random() < self.rate_limit_probability
+            if limited:
+                self.rate_limited += 1
+
+        if limited:
+            return self._send(handler, 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                              {'Retry-After': str(self.retry_after)})
+
+        body = self._route(path, query)
+        if body is None:
+            return self._send(handler, 404, {'error': {'status': 404, 'message': 'Not found'}})
+        self._send(handler, 200, body)
+
+    # -- endpoints --
+
+    def _page(self, path, items, query, default_limit=20):
+        limit = int(query.get('limit', default_limit))
+        offset = int(query.get('offset', 0))
+        next_offset = offset + limit
+        return {
+            'href': f'{self.url}{path}?offset={offset}&limit={limit}',
+            'items': items[offset:next_offset],
+            'limit': limit,
+            'offset': offset,
+            'total': len(items),
+            'next': f'{self.url}{path}?offset={next_offset}&limit={limit}' if next_offset < len(items) else None,
+            'previous': None,
+        }
+
+    def _recently_played(self, query):
+        limit = int(query.get('limit', 20))
+        items = list(zip(self._played_ms, self.fixtures['recently_played']))
+        if query.get('after'):
+            items = [(ms, item) for ms, item in items if ms > int(query['after'])]
+            items = items[-limit:]  # the oldest plays after the cursor
+        elif query.get('before'):
+            items = [(ms, item) for ms, item in items if ms < int(query['before'])][:limit]
+        else:
+            items = items[:limit]
+        cursors = {'after': str(items[0][0]), 'before': str(items[-1][0])} if items else None
+        return {'items': [item for _, item in items], 'limit': limit, 'cursors': cursors, 'next': None}
+
+    def _route(self, path, query):
+        fixtures = self.fixtures
+        if path == '/api/token':
+            return {'access_token': 'bench-token', 'token_type': 'bearer', 'expires_in': 3600}
+        if path == '/v1/me':
+            return fixtures['user']
+        if path == '/v1/me/top/tracks':
+            return self._page(path, fixtures['top_tracks'][query.get('time_range', 'medium_term')], query)
+        if path == '/v1/me/top/artists':
+            return self._page(path, fixtures['top_artists'][query.get('time_range', 'medium_term')], query)
+        if path == '/v1/me/player/recently-played':
+            return self._recently_played(query)
+        if path == '/v1/me/tracks':
+            return self._page(path, fixtures['saved_tracks'], query)
+        if path == '/v1/me/albums':
+            return self._page(path, fixtures['saved_albums'], query)
+        if path == '/v1/me/playlists':
+            return self._page(path, fixtures['playlists'], query)
+        if path == '/v1/artists':
+            return {'artists': [self._artists.get(artist_id) for artist_id in query.get('ids', '').split(',')]}
+        if path == '/v1/search':
+            name = query.get('q', '').lower()
+            matches = [artist for artist in fixtures['artists'] if artist['name'].lower().startswith(name)]
+            return {'artists': self._page(path, matches, query)}
+
+        match = re.fullmatch(r'/v1/artists/([^/]+)(/top-tracks)?', path)
+        if match:
+            artist = self._artists.get(match.group(1))
+            if artist is None:
+                return None
+            if match.group(2):
+                tracks = sorted(self._tracks_by_artist.get(artist['id'], []), key=lambda t: -t['popularity'])
+                return {'tracks': tracks[:10]}
+            return artist
+        return None
+
+
+class RedirectAdapter(HTTPAdapter):
+    # Sends requests for the real Spotify hosts to the fake server instead
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        request.url = re.sub(r'^https://(api|accounts)\.spotify\.com', self.base_url, request.url)
+        return super().send(request, **kwargs)
+
+
+def redirect_session(session, base_url):
+    adapter = RedirectAdapter(base_url)
+    session.mount('https://api.spotify.com', adapter)
+    session.mount('https://accounts.spotify.com', adapter)
+    return session
+
+
+def spotipy_client(base_url, **kwargs):
+    import spotipy
+
+    client = spotipy.Spotify(auth='bench-token', **kwargs)
+    client.prefix = base_url + '/v1/'
+    return client
+
+
+def async_client(base_url, **kwargs):
+    # spotify_async.SyncSpotify pointed at the fake server, interchangeable with spotipy_client()
+    import spotify_async
+
+    client = spotify_async.AsyncSpotify('bench-token', **kwargs)
+    client.prefix = base_url + '/v1/'
+    return spotify_async.SyncSpotify(client)
@@ -0,0 +1,139 @@
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+
+# Sizes of the generated library, roughly a heavy real user
+SIZES = {
+    'artists': 2000,
+    'tracks': 20000,
+    'genres': 300,
+    'saved_tracks': 10000,
+    'saved_albums': 500,
+    'playlists': 300,
+    'recently_played': 50,
+}
+
+USER_ID = 'bench-user'
+
+
+def _spotify_id(rng):
+    alphabet = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return ''.join(rng.choice(alphabet) for _ in range(22))
+
+
+def _timestamp(moment, millis=True):
+    if millis:
+        return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f'{moment.microsecond // 1000:03d}Z'
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def generate(seed=42, sizes=None):
+    """Spotify-shaped fixture data (same fields as the real API responses the app reads)."""
+    sizes = {**SIZES, **(sizes or {})}
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    genres = [f'genre {i}' for i in range(sizes['genres'])]
+    artists = []
+    for i in range(sizes['artists']):
+        artist_id = _spotify_id(rng)
+        artists.append({
+            'id': artist_id,
+            'name': f'Artist {i}',
+            'type': 'artist',
+            'uri': f'spotify:artist:{artist_id}',
+            'genres': rng.sample(genres, rng.randint(0, 4)),
+            'popularity': rng.randint(0, 100),
+            'followers': {'href': None, 'total': rng.randint(0, 5_000_000)},
+            'images': [],
+        })
+
+    albums = []
+    for i in range(sizes['tracks'] // 10):
+        album_id = _spotify_id(rng)
+        artist = rng.choice(artists)
+        albums.append({
+            'id': album_id,
+            'name': f'Album {i}',
+            'album_type': 'album',
+            'uri': f'spotify:album:{album_id}',
+            'release_date': f'{rng.randint(1970, 2024)}-01-01',
+            'total_tracks': 10,
+            'artists': [{'id': artist['id'], 'name': artist['name'], 'type': 'artist'}],
+            'images': [],
+        })
+
+    tracks = []
+    for i in range(sizes['tracks']):
+        track_id = _spotify_id(rng)
+        album = albums[i // 10]
+        tracks.append({
+            'id': track_id,
+            'name': f'Track {i}',
+            'type': 'track',
+            'uri': f'spotify:track:{track_id}',
+            'album': album,
+            'artists': album['artists'],
+            'duration_ms': rng.randint(90_000, 420_000),
+            'explicit': rng.random() < 0.3,
+            'popularity': rng.randint(0, 100),
+            'preview_url': None,
+            'track_number': i % 10 + 1,
+        })
+
+    saved_tracks = []
+    for i, track in enumerate(rng.sample(tracks, sizes['saved_tracks'])):
+        added_at = now - timedelta(minutes=37 * i + rng.randint(0, 30))
+        saved_tracks.append({'added_at': _timestamp(added_at, millis=rng.random() < 0.5), 'track': track})
+
+    saved_albums = [{'added_at': _timestamp(now - timedelta(days=i)), 'album': album}
+                    for i, album in enumerate(rng.sample(albums, sizes['saved_albums']))]
+
+    playlists = []
+    for i in range(sizes['playlists']):
+        playlist_id = _spotify_id(rng)
+        playlists.append({
+            'id': playlist_id,
+            'name': f'Playlist {i}',
+            'uri': f'spotify:playlist:{playlist_id}',
+            'public': rng.random() < 0.5,
+            'collaborative': rng.random() < 0.1,
+            'owner': {'id': USER_ID, 'display_name': 'Bench User'},
+            'tracks': {'href': None, 'total': rng.randint(0, 500)},
+            'images': [],
+        })
+
+    recently_played = []
+    for i in range(sizes['recently_played']):
+        played_at = now - timedelta(minutes=4 * i, seconds=rng.randint(0, 59))
+        recently_played.append({'played_at': _timestamp(played_at), 'track': rng.choice(tracks),
+                                'context': None})
+
+    return {
+        'user': {'id': USER_ID, 'display_name': 'Bench User', 'country': 'US', 'type': 'user',
+                 'followers': {'href': None, 'total': 0}, 'images': []},
+        'artists': artists,
+        'tracks': tracks,
+        'saved_tracks': saved_tracks,
+        'saved_albums': saved_albums,
+        'playlists': playlists,
+        'recently_played': recently_played,
+        'top_tracks': {time_range: rng.sample(tracks, 50) for time_range in
+                       ('short_term', 'medium_term', 'long_term')},
+        'top_artists': {time_range: rng.sample(artists, 50) for time_range in
+                        ('short_term', 'medium_term', 'long_term')},
+    }
+
+
+def save(fixtures, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+
+
+def load(path):
+    # Recorded fixtures use the same layout as generate()
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,191 @@
+"""Offline benchmark of the dashboard data paths against a local fake Spotify server.
+
+    python -m bench.run_bench --latency 0.05 --rate-limit 0.02
+    python -m bench.run_bench --json bench_output.json --compare baseline.json
+
+Every section of dashboard.SECTIONS is run the way sync_worker.py precomputes it: its data sources
+resolved and its compute run for each of its snapshot_params, without rendering. Runs against
+fixture data, reporting wall time, API calls, 429s, response bytes and peak Python memory.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from bench import fixtures as bench_fixtures
+from bench.fake_spotify import FakeSpotify, async_client, redirect_session, spotipy_client
+
+
+# A run fails --compare when it's this much slower, or makes more API calls, than the baseline
+TIME_TOLERANCE = 1.5
+
+
+# -- dashboard.py sections --
+
+def make_context(client):
+    # Like sync_worker.py's: a fresh per-user cache, catalog data in the process-wide shared cache
+    from sections import progress
+    from spotify_cache import CachedSpotify, ResponseCache, shared_cache
+    from spotify_data import ArtistResolver
+
+    cache = ResponseCache()
+    sp = CachedSpotify(client, cache, shared_cache=shared_cache())
+    return SimpleNamespace(sp=sp, cache=cache, artists=ArtistResolver(sp, shared_cache()), progress=progress)
+
+
+def run_section(section, ctx, data=None):
+    # sections.run_section for every snapshot_params, minus the controls and rendering
+    from dashboard import SOURCES
+    from sections import resolve, section_key
+
+    data = resolve(section.needs, SOURCES, ctx, data)
+    for params in section.snapshot_params:
+        ctx.cache.get_or_compute(section_key(section, params), section.ttl,
+                                 lambda: section.compute(ctx, data, **params))
+
+
+# -- main.py --
+
+def artist_search(fake, queries=('artist 1', 'artist 12', 'artist 1', 'artist 123')):
+    # Imports main.py itself (needs streamlit), with its shared session sent to the fake server
+    os.environ.setdefault('CLIENT_ID', 'bench')
+    os.environ.setdefault('CLIENT_SECRET', 'bench')
+    import spotify_http
+    redirect_session(spotify_http.session, fake.url)
+    import main
+    from artist_search import artist_search as search
+
+    for query in queries:
+        artist = search.find_artist(query, lambda: main.search_for_artist(query, main.get_token()))
+        search.top_tracks(artist['id'], lambda: main.get_songs_by_artist(artist['id'], main.get_token()))
+
+
+# -- runner --
+
+def measure(fake, run):
+    fake.reset_stats()
+    tracemalloc.reset_peak()
+    baseline_mem, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    error = None
+    try:
+        run()
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    stats = fake.stats()
+    return {'wall_s': round(wall, 4), 'calls': stats['calls'], 'rate_limited': stats['rate_limited'],
+            'bytes': stats['bytes'], 'peak_mem_bytes': peak - baseline_mem, 'error': error}
+
+
+def run_all(fake, tabs=None, db_path=None, client=spotipy_client):
+    import history_db
+    from prefetch import Prefetched
+    from spotify_cache import shared_cache
+
+    # Everything the app writes (history, saved tracks, similarity index, shared cache) goes to a scratch copy
+    history_db.DB_PATH = db_path or os.path.join(tempfile.mkdtemp(prefix='spotify-bench-'), 'history.db')
+    # Import the heavy modules up front so their import time isn't charged to whichever section runs first
+    import clustering  # noqa: F401
+    import history_analytics  # noqa: F401
+    import similarity  # noqa: F401
+    from dashboard import SECTIONS
+
+    sections = [section for section in SECTIONS if not tabs or section.title in tabs]
+    results = {}
+    tracemalloc.start()
+    try:
+        # Every section on its own with cold caches, then the whole dashboard rerun on warm ones
+        for section in sections:
+            shared_cache().clear()
+            ctx = make_context(client(fake.url))
+            results[section.title] = measure(fake, lambda: run_section(section, ctx))
+
+        shared_cache().clear()
+        ctx = make_context(client(fake.url))
+        for label in ('Dashboard (cold)', 'Dashboard (warm rerun)'):
+            # Each rerun starts with no data fetched, the caches answer what they can
+            data = Prefetched()
+            results[label] = measure(fake, lambda: [run_section(section, ctx, data) for section in sections])
+
+        if not tabs or 'Artist Search' in tabs:
+            results['Artist Search'] = measure(fake, lambda: artist_search(fake))
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def print_table(results):
+    print(f"{'scenario':<30} {'wall s':>8} {'calls':>6} {'429s':>5} {'KB':>9} {'peak MB':>8}")
+    for name, result in results.items():
+        line = (f"{name:<30} {result['wall_s']:>8.3f} {result['calls']:>6} {result['rate_limited']:>5} "
+                f"{result['bytes'] / 1024:>9.1f} {result['peak_mem_bytes'] / 2 ** 20:>8.1f}")
+        if result['error']:
+            line += f"  ERROR {result['error']}"
+        print(line)
+
+
+def compare(results, baseline, tolerance=TIME_TOLERANCE):
+    # List of regressions against a previous --json output
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['calls'] > before['calls']:
+            regressions.append(f"{name}: {before['calls']} -> {result['calls']} API calls")
+        if result['wall_s'] > before['wall_s'] * tolerance:
+            regressions.append(f"{name}: {before['wall_s']:.3f}s -> {result['wall_s']:.3f}s")
+        if result['error'] and not before['error']:
+            regressions.append(f"{name}: {result['error']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every fake API call')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='probability of answering with a 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--fixtures', help='recorded fixture JSON to replay instead of generated data')
+    parser.add_argument('--save-fixtures', help='write the generated fixtures to this path')
+    parser.add_argument('--small', action='store_true', help='generate a small library for quick runs')
+    parser.add_argument('--tab', action='append', dest='tabs', help='only run this section (repeatable)')
+    parser.add_argument('--async', action='store_true', dest='use_async',
+                        help='use the asyncio client (spotify_async) instead of spotipy')
+    parser.add_argument('--json', help='write results to this path')
+    parser.add_argument('--compare', help='fail if slower / more calls than this earlier --json output')
+    args = parser.parse_args(argv)
+
+    if args.fixtures:
+        fixtures = bench_fixtures.load(args.fixtures)
+    else:
+        sizes = {'artists': 200, 'tracks': 2000, 'saved_tracks': 500, 'saved_albums': 50,
+                                       'playlists': 60} if args.small else None
+        fixtures = bench_fixtures.generate(sizes=sizes)
+    if args.save_fixtures:
+        bench_fixtures.save(fixtures, args.save_fixtures)
+
+    with FakeSpotify(fixtures, latency=args.latency, rate_limit_probability=args.rate_limit,
+                     retry_after=args.retry_after) as fake:
+        results = run_all(fake, args.tabs, client=async_client if args.use_async else spotipy_client)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
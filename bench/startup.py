@@ -0,0 +1,105 @@
+"""Import-time benchmark of the app's startup paths.
+
+    python -m bench.startup
+    python -m bench.startup --repeat 5 --top 15
+
+Every path is imported in a fresh interpreter under `python -X importtime`: the login page
+(main2.py's module-level imports), the dashboard once logged in (plus the imports of its
+logged-in block) and the sections that import heavy libraries only when opened. Reports the
+time each of the app's imports adds, the heaviest modules overall and wall time over a bare
+interpreter.
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'main2.py')
+
+# Imported by sections on first use, on top of the dashboard path
+SECTION_IMPORTS = {
+    'ML Analysis': ['clustering', 'ml_features'],
+    'Other Tracks You Might Like': ['similarity'],
+    # Current Trends imports it only for users whose history was exported to Parquet
+    'Current Trends (Parquet export)': ['history_parquet'],
+}
+
+
+def app_imports(path=APP):
+    """(module-level imports, imports of the logged-in block) of main2.py, as module names."""
+    tree = ast.parse(open(path).read())
+    login, logged_in = [], []
+    for node in tree.body:
+        target = login if isinstance(node, (ast.Import, ast.ImportFrom)) else logged_in
+        for child in ast.walk(node):
+            if isinstance(child, ast.Import):
+                target.extend(alias.name for alias in child.names)
+            elif isinstance(child, ast.ImportFrom) and child.module:
+                target.append(child.module)
+    unique = lambda names: list(dict.fromkeys(names))
+    return unique(login), [name for name in unique(logged_in) if name not in login]
+
+
+def startup_paths():
+    login, logged_in = app_imports()
+    dashboard = login + logged_in
+    paths = {'login page': login, 'dashboard': dashboard}
+    for title, modules in SECTION_IMPORTS.items():
+        paths[f'dashboard + {title}'] = dashboard + modules
+    return paths
+
+
+def _import_time(modules):
+    # (wall seconds, {module: (self us, cumulative us)}) of importing `modules` in a new interpreter
+    code = '; '.join(f'import {module}' for module in modules) or 'pass'
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        # Only the first (outermost) import of a module does any work
+        times.setdefault(name.strip(), (int(own), int(cumulative)))
+    return wall, times
+
+
+def measure(modules, repeat=3):
+    """Fastest of `repeat` runs: wall time, each module's added cumulative time, the per-module self times."""
+    runs = [_import_time(modules) for _ in range(repeat)]
+    wall, times = min(runs, key=lambda run: run[0])
+    added = {module: times.get(module, (0, 0))[1] / 1e6 for module in modules}
+    return wall, added, {name: own / 1e6 for name, (own, _) in times.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='runs per path, the fastest is reported')
+    parser.add_argument('--top', type=int, default=10, help='heaviest modules listed per path')
+    args = parser.parse_args(argv)
+
+    baseline, _, _ = measure([], args.repeat)
+    print(f"bare interpreter: {baseline:.2f}s")
+    for title, modules in startup_paths().items():
+        wall, added, own = measure(modules, args.repeat)
+        print(f"\n{title}: {wall:.2f}s wall, {wall - baseline:.2f}s over a bare interpreter")
+        for module, seconds in added.items():
+            # 0 when an earlier import on the path already loaded it
+            print(f"  {module:<28} {seconds:6.3f}s")
+        print(f"  heaviest modules:")
+        for name, seconds in sorted(own.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {name:<40} {seconds:6.3f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from spotify_cache import ResponseCache
+
+
+# Scatter plots with more points than this are drawn from a sample, per color group
+MAX_SCATTER_POINTS = 2000
+# Time series are re-binned to at most this many points
+MAX_LINE_POINTS = 180
+# Pie slices shown before the rest is merged into "Other"
+MAX_SLICES = 15
+
+# Built figures for all sessions together, keyed by the data they were built from. Only building
+# is cached (px grouping, traces, template), st.plotly_chart still serializes the figure on every
+# rerun, which is why large data is binned / sampled before it's charted.
+MAX_FIGURES = 256
+FIGURE_TTL = 60 * 60
+
+_figures = ResponseCache(MAX_FIGURES)
+
+
+def data_hash(*values):
+    """Content hash of the data a chart is built from (DataFrames, Series, arrays, plain values)."""
+    digest = hashlib.sha1()
+    for value in values:
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(list(value.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        elif isinstance(value, pd.Series):
+            digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        elif isinstance(value, np.ndarray):
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            digest.update(repr(sorted(value.items(), key=repr)).encode())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def figure(build, data, layout=None, **kwargs):
+    """build(data, **kwargs) (e.g. px.bar), reused while the same data is charted again.
+
+    Figures are shared between sessions, don't modify the one returned, pass layout instead.
+    The key hashes all of data, so pass the binned / sampled rows rather than the full frame.
+    """
+    key = ('figure', build.__module__, build.__qualname__, data_hash(data, kwargs, layout or {}))
+
+    def build_figure():
+        fig = build(data, **kwargs)
+        if layout:
+            fig.update_layout(**layout)
+        return fig
+
+    return _figures.get_or_compute(key, FIGURE_TTL, build_figure)
+
+
+def rebin_timeline(df, x, y, weight, max_points=MAX_LINE_POINTS):
+    """Daily rows (x as 'YYYY-MM-DD') pre-binned with NumPy into at most max_points equal time bins:
+    y becomes the weight-averaged value and weight the bin total. Bins without rows are dropped."""
+    if len(df) <= max_points:
+        return df
+    days = pd.to_datetime(df[x], format='%Y-%m-%d').to_numpy().astype('datetime64[D]').astype(np.int64)
+    weights = df[weight].to_numpy(dtype=float)
+    edges = np.linspace(days.min(), days.max() + 1, max_points + 1)
+    totals, _ = np.histogram(days, edges, weights=weights)
+    sums, _ = np.histogram(days, edges, weights=weights * df[y].to_numpy(dtype=float))
+
+    keep = totals > 0
+    starts = np.floor(edges[:-1][keep]).astype('int64').astype('datetime64[D]')
+    return pd.DataFrame({x: pd.DatetimeIndex(starts).strftime('%Y-%m-%d'), y: sums[keep] / totals[keep],
+                         weight: totals[keep].astype(int)})
+
+
+def top_slices(counts, names='Name', values='Count', limit=MAX_SLICES, other='Other'):
+    """DataFrame of the largest counts (a dict / Counter), the rest summed into one `other` row."""
+    counts = pd.Series(counts).sort_values(ascending=False, kind='stable')
+    if len(counts) > limit:
+        counts = pd.concat([counts.iloc[:limit], pd.Series({other: counts.iloc[limit:].sum()})])
+    return pd.DataFrame({names: counts.index, values: counts.to_numpy()})
+
+
+def downsample(df, max_points=MAX_SCATTER_POINTS, by=None):
+    """At most max_points rows, sampled within each `by` group in proportion to its size
+    (so small groups stay visible). Deterministic, the same data gives the same sample."""
+    if len(df) <= max_points:
+        return df
+    fraction = max_points / len(df)
+    if by is None:
+        return df.sample(frac=fraction, random_state=0)
+    return df.groupby(by, group_keys=False).sample(frac=fraction, random_state=0)
+
+
+def scatter(df, **kwargs):
+    # px.scatter drawn with WebGL (scattergl), pass it a downsample() of large data
+    return px.scatter(df, render_mode='webgl', **kwargs)
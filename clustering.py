@@ -0,0 +1,126 @@
+import hashlib
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+
+from ml_features import build_features
+
+
+# Above this many tracks fitting switches to MiniBatchKMeans, which also supports partial_fit
+MINIBATCH_THRESHOLD = 2000
+MINIBATCH_SIZE = 1024
+# Candidate k values, scored by silhouette on a sample of at most SILHOUETTE_SAMPLE tracks
+K_RANGE = range(2, 9)
+SILHOUETTE_SAMPLE = 1000
+RANDOM_STATE = 42
+# How long a fitted model / set of labels stays in the cache
+MODEL_TTL = 24 * 60 * 60
+
+
+def matrix_digest(X):
+    # Stable hash of a sparse feature matrix, used as the cache key for fitted results
+    digest = hashlib.sha1(repr(X.shape).encode())
+    for part in (X.data, X.indices, X.indptr):
+        digest.update(np.ascontiguousarray(part).tobytes())
+    return digest.hexdigest()
+
+
+def _distinct_rows(X):
+    return len({(X.indices[start:end].tobytes(), X.data[start:end].tobytes())
+                for start, end in zip(X.indptr[:-1], X.indptr[1:])})
+
+
+def choose_k(X_scaled, max_k):
+    # Best silhouette score on a random sample, fitting the cheap MiniBatch variant for each k
+    candidates = [k for k in K_RANGE if k <= max_k]
+    if len(candidates) <= 1:
+        return candidates[0] if candidates else 1
+
+    rng = np.random.default_rng(RANDOM_STATE)
+    n = X_scaled.shape[0]
+    sample = X_scaled[rng.choice(n, SILHOUETTE_SAMPLE, replace=False)] if n > SILHOUETTE_SAMPLE else X_scaled
+
+    best_k, best_score = candidates[0], -1.0
+    for k in candidates:
+        labels = MiniBatchKMeans(n_clusters=k, random_state=RANDOM_STATE, n_init=3,
+                                 batch_size=MINIBATCH_SIZE).fit_predict(sample)
+        if len(set(labels)) < 2:
+            continue
+        score = silhouette_score(sample, labels)
+        if score > best_score:
+            best_k, best_score = k, score
+    return best_k
+
+
+class ClusterModel:
+    """Fitted scaler + clustering model together with the genre vocabulary its features were built with."""
+
+    def __init__(self, genre_names, keys):
+        self.genre_names = list(genre_names)
+        self.keys = set(keys)
+        self.scaler = None
+        self.model = None
+        self.k = 1
+
+    def fit(self, X):
+        self.scaler = StandardScaler(with_mean=False)
+        X_scaled = self.scaler.fit_transform(X)
+        # k can't be larger than the number of different tracks - 1 for the silhouette score
+        self.k = choose_k(X_scaled, _distinct_rows(X) - 1)
+        if self.k < 2:
+            self.model = None
+        elif X.shape[0] > MINIBATCH_THRESHOLD:
+            self.model = MiniBatchKMeans(n_clusters=self.k, random_state=RANDOM_STATE, n_init=3,
+                                         batch_size=MINIBATCH_SIZE).fit(X_scaled)
+        else:
+            self.model = KMeans(n_clusters=self.k, random_state=RANDOM_STATE, n_init=10).fit(X_scaled)
+        return self
+
+    def can_update(self, genre_names):
+        # partial_fit needs the same feature columns, so new genres mean a full refit
+        return isinstance(self.model, MiniBatchKMeans) and set(genre_names) <= set(self.genre_names)
+
+    def partial_fit(self, X_new, new_keys):
+        self.scaler.partial_fit(X_new)
+        self.model.partial_fit(self.scaler.transform(X_new))
+        self.keys.update(new_keys)
+        return self
+
+    def predict(self, X):
+        if self.model is None:
+            return np.zeros(X.shape[0], dtype=int)
+        return self.model.predict(self.scaler.transform(X))
+
+
+def cluster_tracks(df, cache, key_column='track_id'):
+    """Cluster the tracks in df (needs the ml_features columns plus key_column).
+
+    Returns (labels, k, genre_matrix, genre_names). Nothing is fitted when the same feature matrix
+    was clustered before, and when only new tracks were added to a MiniBatch model they are
+    folded in with partial_fit instead of refitting from scratch.
+    """
+    X, genre_matrix, genre_names = build_features(df)
+    digest = matrix_digest(X)
+    cached = cache.get(('cluster_labels', digest))
+    if cached is not None:
+        labels, k = cached
+        return labels, k, genre_matrix, genre_names
+
+    keys = df[key_column].tolist()
+    model = cache.get(('cluster_model',))
+    if model is not None and model.can_update(genre_names):
+        # Rebuild the features in the model's column order
+        X_model, _, _ = build_features(df, model.genre_names)
+        new_rows = [i for i, key in enumerate(keys) if key not in model.keys]
+        if new_rows:
+            model.partial_fit(X_model[new_rows], [keys[i] for i in new_rows])
+    else:
+        X_model = X
+        model = ClusterModel(genre_names, keys).fit(X)
+
+    labels = model.predict(X_model)
+    cache.set(('cluster_model',), model, MODEL_TTL)
+    cache.set(('cluster_labels', digest), (labels, model.k), MODEL_TTL)
+    return labels, model.k, genre_matrix, genre_names
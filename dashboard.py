@@ -0,0 +1,548 @@
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+from collections import Counter
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+import charts
+import history_db
+import history_analytics
+import taste_drift
+from sections import DataSource, Section
+from spotify_cache import ENDPOINT_TTLS
+from spotify_data import iter_items, iter_pages
+from timestamps import parse_timestamps, time_parts
+
+
+PERIODS = {
+    'Last 4 Weeks': 'short_term',
+    'Last 6 Months': 'medium_term',
+    'All Time': 'long_term'
+}
+
+# Most stored tracks (newest first) the ML section clusters
+ML_HISTORY_TRACKS = 5000
+# Top artists fetched (and recorded for the taste drift) per time range
+TOP_ARTISTS_LIMIT = 50
+
+
+# -- data sources, each fetch(ctx, data) runs in a prefetch thread --
+
+def load_playlists(ctx, data):
+    # Walk every page of playlists, keeping only the fields the playlist section needs
+    return ctx.cache.get_or_compute(('playlist_rows',), ENDPOINT_TTLS['current_user_playlists'], lambda: [{
+        'Name': playlist['name'],
+        'Tracks': playlist['tracks']['total'],
+        'Public': playlist['public'],
+        'Collaborative': playlist['collaborative']
+    } for playlist in iter_items(ctx.sp.client.current_user_playlists) if playlist])
+
+
+def load_top_artists(ctx, data, period):
+    top_artists = ctx.sp.current_user_top_artists(limit=TOP_ARTISTS_LIMIT, time_range=period)
+    ctx.artists.prime(top_artists['items'])
+    return top_artists
+
+
+def record_top_artist_ranks(ctx, data):
+    # Store the ranks of every time range that wasn't recorded in the last TOP_ARTISTS_INTERVAL. Checked
+    # once per session as long as the top artists are cached, they're the same ranks until then
+    user_id = data.get('user')['id']
+
+    def record():
+        now = datetime.now(timezone.utc)
+        due_before = history_db.format_timestamp(now - timedelta(seconds=history_db.TOP_ARTISTS_INTERVAL))
+        with closing(history_db.connect()) as conn:
+            # A plain read first, the write lock is only taken on the (daily) run that has something to record
+            due = {period: data.get(f'top_artists_{period}')['items'] for period in PERIODS.values()
+                   if data.ok(f'top_artists_{period}')
+                   and (history_db.last_top_artists_at(conn, user_id, period) or '') <= due_before}
+            if not due:
+                return 0
+            return len(history_db.record_top_artists(conn, user_id, due, history_db.format_timestamp(now),
+                                                     due_before=due_before))
+
+    return ctx.cache.get_or_compute(('top_artist_ranks',), ENDPOINT_TTLS['current_user_top_artists'], record)
+
+
+def sync_saved_tracks(ctx, data):
+    # Stream the whole library page by page, keeping saves per month for the Library section and compact
+    # rows of the saved tracks, stored in the history database for the recommendations
+    user_id = data.get('user')['id']
+
+    def load():
+        progress = ctx.progress(0.0, text="Loading your saved tracks...")
+        total_saved = 0
+        loaded = 0
+        unparsed = 0
+        saves_per_month = Counter()
+        rows = []
+        for page in iter_pages(ctx.sp.client.current_user_saved_tracks):
+            total_saved = page['total']
+            rows.extend(history_db.saved_track_row(item['track']) for item in page['items']
+                        if item['track'] and item['track'].get('id'))
+            # One vectorized parse per page, handles timestamps with and without milliseconds
+            added_at = parse_timestamps([item['added_at'] for item in page['items']])
+            unparsed += int(added_at.isna().sum())
+            saves_per_month.update(time_parts(added_at)['month'].value_counts().to_dict())
+            loaded += len(page['items'])
+            progress.progress(min(loaded / total_saved, 1.0) if total_saved else 1.0,
+                              text=f"Loaded {loaded} of {total_saved} saved tracks")
+        progress.empty()
+        with closing(history_db.connect()) as conn:
+            history_db.save_saved_tracks(conn, user_id, rows)
+        return total_saved, saves_per_month, unparsed
+
+    return ctx.cache.get_or_compute(('saved_tracks',), ENDPOINT_TTLS['current_user_saved_tracks'], load)
+
+
+def sync_history(ctx, data):
+    # Append plays since the last sync to the history database, history keeps growing past 50
+    user = data.get('user')
+    with closing(history_db.connect()) as conn:
+        history_db.ingest_recently_played(conn, ctx.sp, user['id'])
+        return history_db.count_plays(conn, user['id'])
+
+
+def load_ml_tracks(ctx, data):
+    # Recent plays, stored history and top tracks, one row per track
+    user = data.get('user')
+    ml_tracks = {}
+    def add_track(track, track_type):
+        ml_tracks.setdefault(track['id'] or track['name'], {
+            'track_id': track['id'] or track['name'],
+            'name': track['name'],
+            'artist': track['artists'][0]['name'],
+            'artist_id': track['artists'][0]['id'],
+            'popularity': track['popularity'],
+            'duration_ms': track['duration_ms'],
+            'explicit': 1 if track['explicit'] else 0,
+            'type': track_type
+        })
+
+    if data.ok('recently_played'):
+        for item in data.get('recently_played')['items'][:20]:
+            add_track(item['track'], 'Recent')
+    with closing(history_db.connect()) as conn:
+        for track_id, name, artist_id, artist_name, popularity, duration_ms, explicit in \
+                history_db.distinct_tracks(conn, user['id'], ML_HISTORY_TRACKS):
+            add_track({'id': track_id, 'name': name, 'artists': [{'id': artist_id, 'name': artist_name}],
+                       'popularity': popularity, 'duration_ms': duration_ms, 'explicit': explicit},
+                      'History')
+    if data.ok('top_tracks_medium_term'):
+        for track in data.get('top_tracks_medium_term')['items']:
+            add_track(track, 'Top')
+
+    # Artist genres for every track, resolved 50 artists per request
+    artist_genres = ctx.artists.genres(row['artist_id'] for row in ml_tracks.values() if row['artist_id'])
+    for row in ml_tracks.values():
+        row['genres'] = artist_genres.get(row['artist_id'], [])
+    return list(ml_tracks.values())
+
+
+SOURCES = {
+    'user': DataSource(lambda ctx, data: ctx.sp.current_user()),
+    **{f'top_tracks_{period}': DataSource(
+        lambda ctx, data, period=period: ctx.sp.current_user_top_tracks(limit=20, time_range=period))
+       for period in PERIODS.values()},
+    'playlists': DataSource(load_playlists),
+    'saved_albums': DataSource(lambda ctx, data: ctx.sp.current_user_saved_albums(limit=1)),  # only the total is used
+    **{f'top_artists_{period}': DataSource(lambda ctx, data, period=period: load_top_artists(ctx, data, period))
+       for period in PERIODS.values()},
+    'top_artist_ranks': DataSource(record_top_artist_ranks,
+                                   needs=['user', *(f'top_artists_{period}' for period in PERIODS.values())]),
+    'recently_played': DataSource(lambda ctx, data: ctx.sp.current_user_recently_played(limit=50)),
+    'stored_plays': DataSource(sync_history, needs=['user']),
+    'saved_tracks': DataSource(sync_saved_tracks, needs=['user']),
+    'ml_tracks': DataSource(load_ml_tracks, needs=['user', 'recently_played', 'top_tracks_medium_term']),
+}
+
+
+# -- sections --
+
+def compute_taste_drift(ctx, data):
+    # How the top artists of every time range moved since the previous recording, read from the database
+    user_id = data.get('user')['id']
+    with closing(history_db.connect()) as conn:
+        return {period: taste_drift.drift(conn, user_id, period, ctx.artists.genres) for period in PERIODS.values()}
+
+
+def render_artist_drift(period_name, drift):
+    if drift is None:
+        st.info("Your top artists haven't been recorded yet, check back tomorrow to see how they change")
+        return
+
+    changes = drift['changes']
+    if drift['previous'] is None:
+        st.caption(f"Top artists as of {drift['latest'][:10]}, changes show up from the next recording on")
+        st.dataframe(changes[['Rank', 'Artist']].dropna(subset=['Rank']), hide_index=True)
+        return
+
+    st.caption(f"Top artists on {drift['latest'][:10]} compared with {drift['previous'][:10]}")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("New in your top artists", len(drift['entered']))
+        if drift['entered']:
+            st.write(", ".join(drift['entered']))
+    with col2:
+        st.metric("Dropped out", len(drift['dropped']))
+        if drift['dropped']:
+            st.write(", ".join(drift['dropped']))
+
+    st.dataframe(changes[['Rank', 'Artist', 'Previous Rank', 'Change', 'Status']], hide_index=True)
+
+    if drift['genres'] is not None and not drift['genres'].empty:
+        fig = charts.figure(px.bar, drift['genres'],
+                            x='Genre',
+                            y='Shift',
+                            hover_data=['Share'],
+                            title=f'Genre Share Shift - {period_name}',
+                            layout={'xaxis': {'tickangle': 45}, 'yaxis': {'tickformat': '+.0%'}})
+        st.plotly_chart(fig)
+
+
+def render_taste_evolution(ctx, data, drifts):
+    st.header("Evolution of Music Taste")
+
+    for period_name, period in PERIODS.items():
+        st.subheader(period_name)
+
+        try:
+            top_tracks = data.get(f'top_tracks_{period}')
+
+            if top_tracks and top_tracks['items']:
+                tracks_data = []
+                for track in top_tracks['items']:
+                    tracks_data.append({
+                        'Track Name': track['name'],
+                        'Artist': track['artists'][0]['name'],
+                        'Popularity': track['popularity']
+                    })
+
+                if tracks_data:
+                    df = pd.DataFrame(tracks_data)
+                    st.dataframe(df)
+
+                    fig = px.bar(df,
+                              x='Track Name',
+                              y='Popularity',
+                              hover_data=['Artist'],
+                              title=f'Track Popularity - {period_name}')
+                    fig.update_layout(xaxis={'tickangle': 45})
+                    st.plotly_chart(fig)
+            else:
+                st.warning(f"No top tracks found for {period_name}")
+        except Exception as e:
+            st.error(f"Error getting top tracks for {period_name}: {str(e)}")
+
+        st.write(f"#### Top Artists - {period_name}")
+        render_artist_drift(period_name, drifts[period])
+
+
+def render_playlists(ctx, data, result):
+    st.header("Playlist Analysis")
+
+    playlist_data = data.get('playlists')
+    if playlist_data is not None:
+        if playlist_data:
+            df_playlists = pd.DataFrame(playlist_data)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Total Playlists", len(playlist_data))
+                fig = px.bar(df_playlists,
+                           x='Name',
+                           y='Tracks',
+                           title='Tracks per Playlist')
+                fig.update_layout(xaxis={'tickangle': 45})
+                st.plotly_chart(fig)
+
+            with col2:
+                st.metric("Total Tracks", df_playlists['Tracks'].sum())
+                public_counts = df_playlists['Public'].value_counts()
+                fig = px.pie(values=public_counts.values,
+                           names=['Private', 'Public'],
+                           title='Playlist Visibility')
+                st.plotly_chart(fig)
+        else:
+            st.warning("No playlist data available")
+    else:
+        st.warning("No playlists found")
+
+
+def render_library(ctx, data, result):
+    st.header("Library Statistics")
+
+    total_saved, saves_per_month, unparsed = data.get('saved_tracks')
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Saved Tracks", total_saved)
+        st.metric("Saved Albums", data.get('saved_albums')['total'])
+
+    if unparsed:
+        st.warning(f"Couldn't parse the save date of {unparsed} tracks, they're left out of the timeline")
+
+    # Create timeline of saved tracks
+    if saves_per_month:
+        months = sorted(saves_per_month)
+        timeline = pd.DataFrame({'Added At': months, 'Tracks Saved': [saves_per_month[month] for month in months]})
+        fig = charts.figure(px.bar, timeline,
+                            x='Added At',
+                            y='Tracks Saved',
+                            title='When You Save Tracks')
+        st.plotly_chart(fig)
+    else:
+        st.warning("No timeline data available")
+
+
+def genres_controls(ctx):
+    st.header("Genre Analysis")
+    return {'period_name': st.selectbox("Time range", list(PERIODS), index=2)}
+
+
+def compute_genres(ctx, data, period_name):
+    top_artists = data.get(f'top_artists_{PERIODS[period_name]}')
+    if not (top_artists and top_artists['items']):
+        return None
+    genres = Counter()
+    for genre_list in ctx.artists.genres(artist['id'] for artist in top_artists['items']).values():
+        genres.update(genre_list)
+    return genres
+
+
+def render_genres(ctx, data, genre_counts, period_name):
+    if genre_counts is None:
+        st.warning("No top artists found")
+    elif genre_counts:
+        # Smallest genres as one slice, there can be hundreds
+        fig = charts.figure(px.pie, charts.top_slices(genre_counts, names='Genre', values='Artists'),
+                            values='Artists',
+                            names='Genre',
+                            title=f'Your Music Genres - {period_name}')
+        st.plotly_chart(fig)
+    else:
+        st.warning("No genre data available")
+
+
+def trends_controls(ctx):
+    st.header("Current Trends")
+    return {'window_name': st.selectbox("Time window", list(history_analytics.TIME_WINDOWS), index=1)}
+
+
+def compute_trends(ctx, data, window_name):
+    since = history_analytics.window_start(history_analytics.TIME_WINDOWS[window_name])
+    user_id = data.get('user')['id']
+
+    # Grouped in SQL over the stored history, or over its Parquet export when there is one
+    with closing(history_db.connect()) as conn:
+        return {
+            **history_analytics.window_summary(conn, user_id, since),
+            'recent': history_analytics.recent_plays(conn, user_id),
+        }
+
+
+def render_trends(ctx, data, trends, window_name):
+    try:
+        st.caption(f"{data.get('stored_plays')} plays stored in your listening history")
+    except Exception as e:
+        st.warning(f"Couldn't update listening history: {str(e)}")
+
+    df_recent = trends['recent']
+    if trends['by_hour']['Plays'].sum():
+        col1, col2 = st.columns(2)
+        with col1:
+            fig = charts.figure(px.bar, trends['by_hour'],
+                                x='Hour',
+                                y='Plays',
+                                title='Listening Activity by Hour')
+            st.plotly_chart(fig)
+
+        with col2:
+            fig = charts.figure(px.pie, trends['by_day'],
+                                values='Plays',
+                                names='Day',
+                                title='Listening Activity by Day')
+            st.plotly_chart(fig)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            fig = charts.figure(px.bar, trends['artists'],
+                                x='Artist',
+                                y='Plays',
+                                title=f'Top Artists - {window_name}',
+                                layout={'xaxis': {'tickangle': 45}})
+            st.plotly_chart(fig)
+
+        with col2:
+            # One point per day over all time would be thousands, bin them to a fixed number
+            fig = charts.figure(px.line, charts.rebin_timeline(trends['trend'], 'Date', 'Popularity', 'Plays'),
+                                x='Date',
+                                y='Popularity',
+                                hover_data=['Plays'],
+                                title='Popularity of What You Play')
+            st.plotly_chart(fig)
+    elif not df_recent.empty:
+        st.warning(f"No plays stored for {window_name.lower()}")
+
+    if not df_recent.empty:
+        st.subheader("Recently Played")
+        st.dataframe(df_recent)
+    else:
+        st.warning("No recently played tracks found")
+
+
+def compute_similar_tracks(ctx, data):
+    import similarity
+
+    # Only plays stored since the last update are read, genres only fetched for artists not seen before
+    with closing(history_db.connect()) as conn:
+        index = similarity.update_index(conn, ctx.artists.genres)
+    return pd.DataFrame(index.recommend(data.get('user')['id']),
+                        columns=['track_id', 'name', 'artist', 'popularity', 'similarity', 'your_plays'])
+
+
+def render_similar_tracks(ctx, data, recommendations):
+    from similarity import RECENT_DAYS
+
+    st.header("Other Tracks You Might Like")
+
+    if recommendations.empty:
+        st.warning("No recommendations yet. They're based on your stored listening history, "
+                   "check back once a few plays have been recorded.")
+        return
+
+    st.caption("Closest to what you play and save, leaving out your saved tracks and what you played "
+               f"in the last {RECENT_DAYS} days")
+    df = recommendations.rename(columns={'name': 'Track Name', 'artist': 'Artist', 'popularity': 'Popularity',
+                                         'similarity': 'Similarity', 'your_plays': 'Your Plays'})
+    st.dataframe(df[['Track Name', 'Artist', 'Popularity', 'Similarity', 'Your Plays']],
+                 column_config={'Similarity': st.column_config.ProgressColumn(min_value=0, max_value=1)})
+
+    fig = charts.figure(px.bar, df.head(10),
+                        x='Track Name',
+                        y='Similarity',
+                        hover_data=['Artist'],
+                        title='Closest Matches',
+                        layout={'xaxis': {'tickangle': 45}})
+    st.plotly_chart(fig)
+
+
+def compute_ml(ctx, data):
+    # scikit-learn takes seconds to import, only pay for it when the ML section is opened
+    from clustering import cluster_tracks
+    from ml_features import cluster_genre_counts
+
+    # Recent, stored and top tracks with their artist genres
+    all_tracks = data.get('ml_tracks')
+    if not all_tracks:
+        return None
+    df = pd.DataFrame(all_tracks)
+
+    # Perform clustering, k is picked by silhouette score and the fitted model is reused
+    # between reruns (only new tracks are folded in once the MiniBatch model is used)
+    clusters, n_clusters, genre_matrix, genre_names = cluster_tracks(df, ctx.cache)
+    df['Cluster'] = clusters
+
+    # Genre counts for every cluster in one sparse product
+    genre_counts = cluster_genre_counts(clusters, genre_matrix, n_clusters)
+    return df, n_clusters, genre_counts, genre_names
+
+
+def render_ml(ctx, data, result):
+    from ml_features import top_genres
+
+    st.header("Machine Learning Insights")
+
+    if result is None:
+        st.warning("Not enough track data for analysis")
+        return
+    df, n_clusters, genre_counts, genre_names = result
+
+    # Display clusters
+    st.subheader("Song Clusters Analysis (Including Genres)")
+
+    # Scatter plot of clusters, WebGL and a per-cluster sample once there are many tracks
+    # (sampled first, so only the sample is hashed for the figure cache)
+    points = charts.downsample(df[['popularity', 'duration_ms', 'Cluster', 'name', 'artist']], by='Cluster')
+    fig = charts.figure(charts.scatter, points,
+                        x='popularity',
+                        y='duration_ms',
+                        color='Cluster',
+                        hover_data=['name', 'artist'],
+                        title='Song Clusters based on Features and Genres')
+    st.plotly_chart(fig)
+
+    # Analysis of each cluster
+    for cluster in range(n_clusters):
+        cluster_df = df[df['Cluster'] == cluster]
+        st.write(f"### Cluster {cluster + 1} Characteristics:")
+
+        # Basic metrics
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Average Popularity",
+                    f"{cluster_df['popularity'].mean():.1f}")
+        with col2:
+            st.metric("Average Duration",
+                    f"{(cluster_df['duration_ms'].mean() / 60000):.2f} min")
+        with col3:
+            st.metric("Explicit Content",
+                    f"{(cluster_df['explicit'].mean() * 100):.1f}%")
+
+        # Most common genres in this cluster
+        cluster_top_genres = top_genres(genre_counts[cluster], genre_names)
+        if cluster_top_genres:
+            st.write("Top genres in this cluster:")
+            for genre, count in cluster_top_genres:
+                st.write(f"- {genre}: {count} tracks")
+
+        st.write("Sample tracks from this cluster:")
+        st.dataframe(cluster_df[['name', 'artist', 'type']].head())
+        st.write("---")
+
+    # Genre distribution visualization
+    st.subheader("Genre Distribution Across Clusters")
+    genre_cluster_data = []
+    for cluster in range(n_clusters):
+        for genre, count in top_genres(genre_counts[cluster], genre_names):
+            genre_cluster_data.append({
+                'Cluster': f'Cluster {cluster + 1}',
+                'Genre': genre,
+                'Count': count
+            })
+
+    genre_df = pd.DataFrame(genre_cluster_data)
+    fig = charts.figure(px.bar, genre_df,
+                        x='Cluster',
+                        y='Count',
+                        color='Genre',
+                        title='Top Genres by Cluster')
+    st.plotly_chart(fig)
+
+
+SECTIONS = [
+    # Artist drift comes from the recorded ranks, so it only changes when new ones are recorded
+    Section("Music Taste Evolution",
+            ['user', 'top_artist_ranks', *(f'top_tracks_{period}' for period in PERIODS.values())],
+            render_taste_evolution, compute=compute_taste_drift,
+            ttl=ENDPOINT_TTLS['current_user_top_artists']),
+    Section("Playlist Analysis", ['playlists'], render_playlists,
+            error_message="Error analyzing playlists"),
+    Section("Library Statistics", ['saved_albums', 'saved_tracks'], render_library,
+            error_message="Error analyzing library"),
+    Section("Genre Analysis", [f'top_artists_{period}' for period in PERIODS.values()], render_genres,
+            compute=compute_genres, controls=genres_controls, error_message="Error analyzing genres",
+            snapshot_params=[{'period_name': period_name} for period_name in PERIODS]),
+    # Recomputed at most as often as the history is synced
+    Section("Current Trends", ['user', 'stored_plays'], render_trends, compute=compute_trends,
+            controls=trends_controls, error_message="Error analyzing recent tracks",
+            ttl=history_db.MIN_SYNC_INTERVAL,
+            snapshot_params=[{'window_name': window_name} for window_name in history_analytics.TIME_WINDOWS]),
+    # Recommendations change when plays are stored, same as the trends. Saved tracks are read from the
+    # database, stored whenever the Library section, the warm-up or sync_worker.py fetch saved_tracks
+    Section("Other Tracks You Might Like", ['user', 'stored_plays'], render_similar_tracks,
+            compute=compute_similar_tracks, error_message="Error finding similar tracks",
+            ttl=history_db.MIN_SYNC_INTERVAL),
+    Section("ML Analysis", ['ml_tracks'], render_ml, compute=compute_ml,
+            error_message="Error in ML analysis"),
+]
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+import history_db
+from timestamps import DAY_NAMES, time_parts
+
+
+# Aggregations over listening_history run as grouped SQL on the (user_id, played_at) index,
+# only the grouped rows ever reach pandas/plotly. Users whose history has been exported to
+# Parquet (history_parquet.py) are aggregated from the memory-mapped columns instead.
+
+# Label -> how far back to look (None means everything stored)
+TIME_WINDOWS = {
+    'Last 7 Days': timedelta(days=7),
+    'Last 30 Days': timedelta(days=30),
+    'Last Year': timedelta(days=365),
+    'All Time': None,
+}
+
+
+def window_start(window):
+    # played_at is stored as Spotify's ISO string, so bounds are compared as strings in the same format
+    if window is None:
+        return ''
+    return (datetime.now(timezone.utc) - window).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def plays_by_hour(conn, user_id, since=''):
+    df = pd.read_sql_query(
+        """SELECT CAST(strftime('%H', played_at) AS INTEGER) AS Hour, COUNT(*) AS Plays
+           FROM listening_history
+           WHERE user_id = ? AND played_at >= ?
+           GROUP BY Hour""",
+        conn, params=(user_id, since))
+    # Every hour on the axis, even the ones without plays
+    return df.set_index('Hour').reindex(range(24), fill_value=0).reset_index()
+
+
+def plays_by_weekday(conn, user_id, since=''):
+    df = pd.read_sql_query(
+        """SELECT CAST(strftime('%w', played_at) AS INTEGER) AS Weekday, COUNT(*) AS Plays
+           FROM listening_history
+           WHERE user_id = ? AND played_at >= ?
+           GROUP BY Weekday
+           ORDER BY Weekday""",
+        conn, params=(user_id, since))
+    df['Day'] = [DAY_NAMES[day] for day in df['Weekday']]
+    return df[['Day', 'Plays']]
+
+
+def top_artists(conn, user_id, since='', limit=10):
+    return pd.read_sql_query(
+        """SELECT artist_name AS Artist, COUNT(*) AS Plays
+           FROM listening_history
+           WHERE user_id = ? AND played_at >= ?
+           GROUP BY artist_name
+           ORDER BY Plays DESC, Artist
+           LIMIT ?""",
+        conn, params=(user_id, since, limit))
+
+
+def popularity_trend(conn, user_id, since=''):
+    # Average popularity of what was played, per day
+    return pd.read_sql_query(
+        """SELECT strftime('%Y-%m-%d', played_at) AS Date, AVG(popularity) AS Popularity, COUNT(*) AS Plays
+           FROM listening_history
+           WHERE user_id = ? AND played_at >= ?
+           GROUP BY Date
+           ORDER BY Date""",
+        conn, params=(user_id, since))
+
+
+def recent_plays(conn, user_id, limit=10):
+    return pd.read_sql_query(
+        """SELECT track_name AS Track, artist_name AS Artist, played_at AS "Played At"
+           FROM listening_history
+           WHERE user_id = ?
+           ORDER BY played_at DESC
+           LIMIT ?""",
+        conn, params=(user_id, limit))
+
+
+def window_summary(conn, user_id, since='', root=None):
+    """plays_by_hour, plays_by_weekday, top_artists and popularity_trend for one window."""
+    if history_db.parquet_exported_through(conn, user_id):
+        # Imported here so pyarrow only loads for users with an export
+        import history_parquet
+
+        if history_parquet.exported_through(conn, user_id, root):
+            plays = history_parquet.load_plays(conn, user_id, since, root,
+                                               columns=['played_at', 'artist_name', 'popularity'])
+            return summarize_plays(plays)
+    return {
+        'by_hour': plays_by_hour(conn, user_id, since),
+        'by_day': plays_by_weekday(conn, user_id, since),
+        'artists': top_artists(conn, user_id, since),
+        'trend': popularity_trend(conn, user_id, since),
+    }
+
+
+def summarize_plays(plays, limit=10):
+    # Same frames as the SQL aggregations above, from a DataFrame with a UTC played_at column
+    played_at = plays['played_at']
+    parts = time_parts(played_at)
+
+    hours = parts['hour'].value_counts(sort=False)
+    by_hour = pd.DataFrame({'Hour': hours.index.astype(int), 'Plays': hours.values})
+
+    # Only the days that have plays, like the SQL version
+    weekdays = parts['weekday'].value_counts(sort=False)
+    weekdays = weekdays[weekdays > 0]
+    by_day = pd.DataFrame({'Day': weekdays.index.astype(str), 'Plays': weekdays.values})
+
+    artists = plays.groupby('artist_name', observed=True).size()
+    artists = pd.DataFrame({'Artist': artists.index.astype(str), 'Plays': artists.values})
+    artists = artists.sort_values(['Plays', 'Artist'], ascending=[False, True]).head(limit).reset_index(drop=True)
+
+    days = plays.groupby(played_at.dt.floor('D'))['popularity'].agg(['mean', 'size'])
+    trend = pd.DataFrame({'Date': days.index.strftime('%Y-%m-%d'), 'Popularity': days['mean'].values,
+                          'Plays': days['size'].values})
+
+    return {'by_hour': by_hour, 'by_day': by_day, 'artists': artists, 'trend': trend}
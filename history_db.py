@@ -0,0 +1,350 @@
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+# The committed database is only the starting point. The one the app writes to (refresh tokens,
+# caches) is a copy outside git: $SPOTIFY_HISTORY_DB, or data/spotify_history.db by default.
+SEED_PATH = os.path.join(_ROOT, 'spotify_history.db')
+DB_PATH = os.getenv('SPOTIFY_HISTORY_DB') or os.path.join(_ROOT, 'data', 'spotify_history.db')
+
+# recently-played never returns more than 50 items per request
+RECENTLY_PLAYED_LIMIT = 50
+# Don't poll Spotify more often than this per user, reruns in between are free
+MIN_SYNC_INTERVAL = 60
+# Snapshots older than this are ignored and the dashboard goes back to live calls
+SNAPSHOT_MAX_AGE = 3 * 60 * 60
+# Top artist ranks are recorded at most this often per user, to compare one day with the next
+TOP_ARTISTS_INTERVAL = 24 * 60 * 60
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS listening_history
+       (user_id TEXT, track_name TEXT, artist_name TEXT,
+        played_at TIMESTAMP, popularity INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS top_artists
+       (user_id TEXT, artist_name TEXT, time_range TEXT,
+        rank INTEGER, recorded_at TIMESTAMP)""",
+    # Where the last recently-played poll stopped, per user
+    """CREATE TABLE IF NOT EXISTS ingest_cursors
+       (user_id TEXT PRIMARY KEY, after_ms INTEGER, synced_at REAL)""",
+    # Saved at login so sync_worker.py can refresh a user's data without them
+    """CREATE TABLE IF NOT EXISTS refresh_tokens
+       (user_id TEXT PRIMARY KEY, refresh_token TEXT, updated_at REAL)""",
+    # Latest precomputed dashboard data per user, written by sync_worker.py
+    """CREATE TABLE IF NOT EXISTS snapshots
+       (user_id TEXT PRIMARY KEY, data BLOB, computed_at REAL)""",
+    """CREATE TABLE IF NOT EXISTS track_clusters
+       (user_id TEXT, track_id TEXT, cluster INTEGER, recorded_at TIMESTAMP)""",
+    # Newest play already written to the user's Parquet files (see history_parquet.py)
+    """CREATE TABLE IF NOT EXISTS parquet_exports
+       (user_id TEXT PRIMARY KEY, exported_through TEXT, exported_at REAL)""",
+    # Every user's saved tracks (their library), and when that set last changed
+    """CREATE TABLE IF NOT EXISTS saved_tracks
+       (user_id TEXT, track_id TEXT, track_name TEXT, artist_id TEXT, artist_name TEXT,
+        popularity INTEGER, duration_ms INTEGER, explicit INTEGER, PRIMARY KEY (user_id, track_id))""",
+    """CREATE TABLE IF NOT EXISTS library_syncs
+       (user_id TEXT PRIMARY KEY, changed_at REAL)""",
+    # Artist genres (JSON list) the similarity index looked up, so a restart doesn't look them up again
+    """CREATE TABLE IF NOT EXISTS artist_genres
+       (artist_id TEXT PRIMARY KEY, genres TEXT)""",
+]
+
+# Columns added after the original schema, filled for new plays only
+HISTORY_COLUMNS = {
+    'track_id': 'TEXT',
+    'artist_id': 'TEXT',
+    'duration_ms': 'INTEGER',
+    'explicit': 'INTEGER',
+}
+TOP_ARTIST_COLUMNS = {
+    'artist_id': 'TEXT',
+}
+
+INDEXES = [
+    # Older databases may hold the same play several times, keep the first copy before adding the unique index
+    """DELETE FROM listening_history WHERE rowid NOT IN
+       (SELECT MIN(rowid) FROM listening_history GROUP BY user_id, played_at)""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_history_user_played ON listening_history (user_id, played_at)",
+    "CREATE INDEX IF NOT EXISTS idx_history_user_artist ON listening_history (user_id, artist_name)",
+]
+SNAPSHOT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_top_artists_user_range ON top_artists (user_id, time_range, recorded_at)",
+    "CREATE INDEX IF NOT EXISTS idx_track_clusters_user ON track_clusters (user_id)",
+]
+
+
+def _create(path):
+    # First run, start from the committed history (copied under a temporary name so nobody opens half of it)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(SEED_PATH) and os.path.abspath(path) != SEED_PATH:
+        shutil.copyfile(SEED_PATH, f'{path}.{os.getpid()}.tmp')
+        if not os.path.exists(path):
+            os.replace(f'{path}.{os.getpid()}.tmp', path)
+        else:
+            os.remove(f'{path}.{os.getpid()}.tmp')
+
+
+def connect(path=None):
+    # One connection per thread, WAL lets the dashboard read while ingestion writes
+    path = path or DB_PATH
+    if not os.path.exists(path):
+        _create(path)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    ensure_schema(conn)
+    return conn
+
+
+def ensure_schema(conn):
+    with conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for table, columns in (('listening_history', HISTORY_COLUMNS), ('top_artists', TOP_ARTIST_COLUMNS)):
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_history_user_played'").fetchone():
+            for statement in INDEXES:
+                conn.execute(statement)
+        for statement in SNAPSHOT_INDEXES:
+            conn.execute(statement)
+
+
+def parse_spotify_timestamp(value):
+    # Spotify sends ISO-8601 in UTC, with or without milliseconds
+    fmt = '%Y-%m-%dT%H:%M:%S.%fZ' if '.' in value else '%Y-%m-%dT%H:%M:%SZ'
+    return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+
+
+def format_timestamp(value):
+    # Same format Spotify uses, so stored timestamps sort and compare as strings
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _get_cursor(conn, user_id):
+    row = conn.execute("SELECT after_ms, synced_at FROM ingest_cursors WHERE user_id = ?", (user_id,)).fetchone()
+    if row:
+        return row
+    # No cursor yet, start from the newest play we already have (if any)
+    latest = conn.execute("SELECT MAX(played_at) FROM listening_history WHERE user_id = ?", (user_id,)).fetchone()[0]
+    after_ms = int(parse_spotify_timestamp(latest).timestamp() * 1000) if latest else None
+    return after_ms, None
+
+
+def _history_row(user_id, item):
+    track = item['track']
+    artist = track['artists'][0]
+    return (user_id, track['name'], artist['name'], item['played_at'], track.get('popularity'),
+            track.get('id'), artist.get('id'), track.get('duration_ms'), 1 if track.get('explicit') else 0)
+
+
+def ingest_recently_played(conn, sp, user_id, min_interval=MIN_SYNC_INTERVAL):
+    """Store plays newer than the user's cursor in listening_history. Returns how many rows were new."""
+    after_ms, synced_at = _get_cursor(conn, user_id)
+    if synced_at and time.time() - synced_at < min_interval:
+        return 0
+
+    rows = []
+    while True:
+        recent = sp.current_user_recently_played(limit=RECENTLY_PLAYED_LIMIT, after=after_ms)
+        items = recent['items'] if recent else []
+        rows.extend(_history_row(user_id, item) for item in items)
+
+        # cursors.after is the newest play returned, the next poll starts there
+        after = ((recent or {}).get('cursors') or {}).get('after')
+        if after:
+            after_ms = int(after)
+        if len(items) < RECENTLY_PLAYED_LIMIT or not after:
+            break
+
+    with conn:
+        before = conn.total_changes
+        conn.executemany(
+            """INSERT OR IGNORE INTO listening_history
+               (user_id, track_name, artist_name, played_at, popularity,
+                track_id, artist_id, duration_ms, explicit)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            rows)
+        inserted = conn.total_changes - before
+        conn.execute(
+            """INSERT INTO ingest_cursors (user_id, after_ms, synced_at) VALUES (?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET after_ms = excluded.after_ms, synced_at = excluded.synced_at""",
+            (user_id, after_ms, time.time()))
+    return inserted
+
+
+def count_plays(conn, user_id):
+    return conn.execute("SELECT COUNT(*) FROM listening_history WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def distinct_tracks(conn, user_id, limit=None):
+    # One row per stored track (newest plays first), only rows ingested with track metadata
+    return conn.execute(
+        """SELECT track_id, track_name, artist_id, artist_name, MAX(popularity), duration_ms, explicit
+           FROM listening_history
+           WHERE user_id = ? AND track_id IS NOT NULL
+           GROUP BY track_id
+           ORDER BY MAX(played_at) DESC
+           LIMIT ?""",
+        (user_id, -1 if limit is None else limit)).fetchall()
+
+
+def save_refresh_token(conn, user_id, refresh_token):
+    with conn:
+        conn.execute(
+            """INSERT INTO refresh_tokens (user_id, refresh_token, updated_at) VALUES (?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET refresh_token = excluded.refresh_token, updated_at = excluded.updated_at
+               WHERE refresh_token != excluded.refresh_token""",
+            (user_id, refresh_token, time.time()))
+
+
+def refresh_tokens(conn):
+    return conn.execute("SELECT user_id, refresh_token FROM refresh_tokens ORDER BY user_id").fetchall()
+
+
+def record_top_artists(conn, user_id, artists_by_range, recorded_at, due_before=None):
+    """One row per artist in rank order for every time range, all inserted in one go. With due_before,
+    time ranges recorded after it are skipped, checked in the same write transaction so two processes
+    can't both record a range. Returns the time ranges recorded."""
+    with conn:
+        # IMMEDIATE takes the write lock before the check, a second writer waits here
+        conn.execute("BEGIN IMMEDIATE")
+        if due_before is not None:
+            artists_by_range = {time_range: artists for time_range, artists in artists_by_range.items()
+                                if (last_top_artists_at(conn, user_id, time_range) or '') <= due_before}
+        conn.executemany(
+            """INSERT INTO top_artists (user_id, artist_name, time_range, rank, recorded_at, artist_id)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [(user_id, artist['name'], time_range, rank, recorded_at, artist['id'])
+             for time_range, artists in artists_by_range.items()
+             for rank, artist in enumerate(artists, start=1)])
+    return list(artists_by_range)
+
+
+def last_top_artists_at(conn, user_id, time_range):
+    # recorded_at of the user's newest top artists for time_range, None if they were never recorded
+    return conn.execute("SELECT MAX(recorded_at) FROM top_artists WHERE user_id = ? AND time_range = ?",
+                        (user_id, time_range)).fetchone()[0]
+
+
+def parquet_exported_through(conn, user_id):
+    # played_at of the newest play written to the user's Parquet files, None when they have no export
+    row = conn.execute("SELECT exported_through FROM parquet_exports WHERE user_id = ?", (user_id,)).fetchone()
+    return None if row is None else row[0]
+
+
+def record_track_clusters(conn, user_id, assignments, recorded_at):
+    # Replaces the user's previous assignments, `assignments` is (track_id, cluster) pairs
+    with conn:
+        conn.execute("DELETE FROM track_clusters WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT INTO track_clusters (user_id, track_id, cluster, recorded_at) VALUES (?, ?, ?, ?)",
+            [(user_id, track_id, int(cluster), recorded_at) for track_id, cluster in assignments])
+
+
+def save_snapshot(conn, user_id, snapshot, computed_at=None):
+    # Pickled since it holds DataFrames, only ever written by our own worker
+    with conn:
+        conn.execute(
+            """INSERT INTO snapshots (user_id, data, computed_at) VALUES (?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, computed_at = excluded.computed_at""",
+            (user_id, pickle.dumps(snapshot), time.time() if computed_at is None else computed_at))
+
+
+def load_snapshot(conn, user_id, max_age=SNAPSHOT_MAX_AGE):
+    """The user's snapshot and when it was computed, or None when there is none newer than max_age."""
+    row = conn.execute("SELECT data, computed_at FROM snapshots WHERE user_id = ? AND computed_at >= ?",
+                       (user_id, time.time() - max_age)).fetchone()
+    if row is None:
+        return None
+    return pickle.loads(row[0]), row[1]
+
+
+def saved_track_row(track):
+    # What's stored of a saved track (as Spotify returns it), the columns of saved_tracks after user_id
+    artist = track['artists'][0]
+    return (track['id'], track['name'], artist['id'], artist['name'], track.get('popularity'),
+            track.get('duration_ms'), 1 if track.get('explicit') else 0)
+
+
+def save_saved_tracks(conn, user_id, rows):
+    """Replace the user's saved tracks (saved_track_row() tuples) when the set changed. Returns whether it did."""
+    rows = {row[0]: (user_id, *row) for row in rows}
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        stored = {row[0] for row in conn.execute("SELECT track_id FROM saved_tracks WHERE user_id = ?", (user_id,))}
+        synced = conn.execute("SELECT 1 FROM library_syncs WHERE user_id = ?", (user_id,)).fetchone()
+        if synced and stored == rows.keys():
+            return False
+        conn.execute("DELETE FROM saved_tracks WHERE user_id = ?", (user_id,))
+        conn.executemany("INSERT INTO saved_tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows.values())
+        conn.execute(
+            """INSERT INTO library_syncs (user_id, changed_at) VALUES (?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET changed_at = excluded.changed_at""",
+            (user_id, time.time()))
+    return True
+
+
+def library_changes(conn):
+    # user_id -> when their saved tracks last changed
+    return dict(conn.execute("SELECT user_id, changed_at FROM library_syncs").fetchall())
+
+
+def saved_tracks(conn, user_id):
+    return conn.execute(
+        """SELECT track_id, track_name, artist_id, artist_name, popularity, duration_ms, explicit
+           FROM saved_tracks WHERE user_id = ?""",
+        (user_id,)).fetchall()
+
+
+def last_play_rowid(conn):
+    return conn.execute("SELECT MAX(rowid) FROM listening_history").fetchone()[0] or 0
+
+
+def play_totals(conn, after_rowid, through_rowid):
+    """One row per track played in (after_rowid, through_rowid]: track_id, track_name, artist_id, artist_name,
+    popularity, duration_ms, explicit (of its newest play there) and how often it was played (all users)."""
+    # Bare columns next to MAX() come from the row holding the maximum
+    rows = conn.execute(
+        """SELECT track_id, track_name, artist_id, artist_name, popularity, duration_ms, explicit, COUNT(*),
+                  MAX(rowid)
+           FROM listening_history
+           WHERE rowid > ? AND rowid <= ? AND track_id IS NOT NULL
+           GROUP BY track_id""",
+        (after_rowid, through_rowid)).fetchall()
+    return [row[:-1] for row in rows]
+
+
+def user_play_totals(conn, after_rowid, through_rowid):
+    # (user_id, track_id, plays, last played_at) of the plays in (after_rowid, through_rowid]
+    return conn.execute(
+        """SELECT user_id, track_id, COUNT(*), MAX(played_at)
+           FROM listening_history
+           WHERE rowid > ? AND rowid <= ? AND track_id IS NOT NULL
+           GROUP BY user_id, track_id""",
+        (after_rowid, through_rowid)).fetchall()
+
+
+def artist_genres(conn, artist_ids, chunk_size=500):
+    # artist id -> genres, of the artists stored with save_artist_genres()
+    artist_ids = list(artist_ids)
+    found = {}
+    for start in range(0, len(artist_ids), chunk_size):
+        chunk = artist_ids[start:start + chunk_size]
+        found.update((artist_id, json.loads(genres)) for artist_id, genres in conn.execute(
+            f"SELECT artist_id, genres FROM artist_genres WHERE artist_id IN ({', '.join('?' * len(chunk))})",
+            chunk))
+    return found
+
+
+def save_artist_genres(conn, genres_by_artist):
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO artist_genres (artist_id, genres) VALUES (?, ?)",
+                         [(artist_id, json.dumps(genres)) for artist_id, genres in genres_by_artist.items()])
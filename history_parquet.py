@@ -0,0 +1,163 @@
+"""Columnar copy of listening_history as Parquet, one file per user and month.
+
+    python history_parquet.py            # export every user's new plays
+    python history_parquet.py --user ID
+
+Artist and track columns are dictionary encoded and played_at is a native UTC timestamp,
+so reading a multi-year history is a memory-mapped Arrow read instead of a row-wise SQLite
+scan plus timestamp parsing. SQLite stays the source of truth: exports only ever append months
+that got new plays, and readers add the plays newer than the last export from SQLite.
+Files go to $SPOTIFY_PARQUET_DIR, or next to the history database (data/history_parquet/ by default).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from contextlib import closing
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import history_db
+from timestamps import parse_timestamps
+
+
+_STRING_DICT = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMA = pa.schema([
+    ('played_at', pa.timestamp('ms', tz='UTC')),
+    ('track_id', _STRING_DICT),
+    ('track_name', _STRING_DICT),
+    ('artist_id', _STRING_DICT),
+    ('artist_name', _STRING_DICT),
+    ('popularity', pa.int16()),
+    ('duration_ms', pa.int32()),
+    ('explicit', pa.bool_()),
+])
+
+COLUMNS = SCHEMA.names
+
+
+def parquet_dir():
+    # $SPOTIFY_PARQUET_DIR, or history_parquet/ next to the history database (outside git like the database)
+    return os.getenv('SPOTIFY_PARQUET_DIR') or os.path.join(os.path.dirname(os.path.abspath(history_db.DB_PATH)),
+                                                            'history_parquet')
+
+
+def _user_dir(root, user_id):
+    return os.path.join(root or parquet_dir(), f'user_id={user_id}')
+
+
+def _month_path(root, user_id, month):
+    return os.path.join(_user_dir(root, user_id), f'month={month}', 'plays.parquet')
+
+
+def exported_through(conn, user_id, root=None):
+    # played_at of the newest exported play, or None when the user has no (intact) export
+    through = history_db.parquet_exported_through(conn, user_id)
+    if through is None or not os.path.isdir(_user_dir(root, user_id)):
+        return None
+    return through
+
+
+def _to_table(plays):
+    plays = plays.assign(
+        played_at=parse_timestamps(plays['played_at']),
+        explicit=plays['explicit'].astype('boolean'),
+    )
+    return pa.Table.from_pandas(plays[COLUMNS], schema=SCHEMA, preserve_index=False)
+
+
+def export_history(conn, user_id, root=None):
+    """Write every month with plays newer than the last export. Returns the months written."""
+    through = exported_through(conn, user_id, root)
+    # Months are rewritten whole, starting with the one the last export stopped in
+    plays = pd.read_sql_query(
+        f"""SELECT {', '.join(COLUMNS)}
+            FROM listening_history
+            WHERE user_id = ? AND played_at >= ?
+            ORDER BY played_at""",
+        conn, params=(user_id, through[:7] if through else ''))
+    if plays.empty:
+        return []
+
+    months = plays['played_at'].str[:7]
+    for month, month_plays in plays.groupby(months, sort=True):
+        path = _month_path(root, user_id, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a half written file
+        pq.write_table(_to_table(month_plays), path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+
+    with conn:
+        conn.execute(
+            """INSERT INTO parquet_exports (user_id, exported_through, exported_at) VALUES (?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET exported_through = excluded.exported_through,
+                                                  exported_at = excluded.exported_at""",
+            (user_id, plays['played_at'].iloc[-1], time.time()))
+    return sorted(months.unique())
+
+
+def load_history(user_id, since='', root=None, columns=None):
+    """The user's exported plays since `since` (an ISO string like history_analytics.window_start
+    returns) as a DataFrame. Files are memory-mapped and only the months in range are opened;
+    dictionary columns come back as categoricals."""
+    columns = columns or COLUMNS
+    if since and 'played_at' not in columns:
+        columns = ['played_at', *columns]
+    paths = [path for path in sorted(glob.glob(_month_path(root, user_id, '*')))
+             if os.path.basename(os.path.dirname(path))[len('month='):] >= since[:7]]
+    if not paths:
+        return SCHEMA.empty_table().select(columns).to_pandas()
+
+    table = pa.concat_tables(pq.read_table(path, columns=columns, memory_map=True) for path in paths)
+    if since:
+        since_ts = pa.scalar(history_db.parse_spotify_timestamp(since), type=SCHEMA.field('played_at').type)
+        table = table.filter(pc.greater_equal(table['played_at'], since_ts))
+    # Arrow buffers are handed to pandas (and released) column by column instead of copied in one go
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def load_plays(conn, user_id, since='', root=None, columns=None):
+    """Like load_history, plus the plays SQLite has that aren't exported yet."""
+    columns = columns or COLUMNS
+    through = exported_through(conn, user_id, root) or ''
+    plays = load_history(user_id, since, root, columns) if through else None
+
+    newer = pd.read_sql_query(
+        f"""SELECT {', '.join(columns)}
+            FROM listening_history
+            WHERE user_id = ? AND played_at > ? AND played_at >= ?
+            ORDER BY played_at""",
+        conn, params=(user_id, through, since))
+    if 'played_at' in newer:
+        newer['played_at'] = parse_timestamps(newer['played_at'])
+    if plays is None:
+        return newer
+    if newer.empty:
+        return plays
+    return pd.concat([plays, newer], ignore_index=True)
+
+
+def export_all(users=None, root=None):
+    with closing(history_db.connect()) as conn:
+        user_ids = users or [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM listening_history")]
+        return {user_id: export_history(conn, user_id, root) for user_id in user_ids}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--user', action='append', dest='users', help='only export this user id (repeatable)')
+    parser.add_argument('--root', help='directory the Parquet files are written to (default: parquet_dir())')
+    args = parser.parse_args(argv)
+
+    for user_id, months in export_all(args.users, args.root).items():
+        print(f"{user_id}: {len(months)} month(s) written" + (f" ({months[0]} .. {months[-1]})" if months else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from spotipy.exceptions import SpotifyException
+
+
+_current = contextvars.ContextVar('tracer', default=None)
+
+
+class Tracer:
+    """Timing spans and counters for one script run of the dashboard.
+
+    Spans are (name, category, start, duration, thread) with start relative to the tracer's creation,
+    so they can be drawn as a waterfall. Safe to use from prefetch threads.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category='compute', **attrs):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            record = {
+                'name': name,
+                'category': category,
+                'start': start - self._origin,
+                'duration': end - start,
+                'thread': threading.current_thread().name,
+                **attrs,
+            }
+            if error:
+                record['error'] = error
+            with self._lock:
+                self.spans.append(record)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def to_jsonl(self):
+        # One JSON object per span, tagged with when the run started
+        return '\n'.join(json.dumps({'run_started_at': self.started_at, **span}) for span in self.spans) + '\n'
+
+    def append_jsonl(self, path):
+        # For tracking timings across runs / deploys
+        with open(path, 'a') as f:
+            f.write(self.to_jsonl())
+
+    def to_prometheus(self, prefix='spotify_dashboard'):
+        lines = [f'# TYPE {prefix}_span_seconds summary']
+        totals = {}
+        for span in self.spans:
+            key = (span['category'], span['name'])
+            duration, count = totals.get(key, (0.0, 0))
+            totals[key] = (duration + span['duration'], count + 1)
+        for (category, name), (duration, count) in sorted(totals.items()):
+            labels = f'category="{category}",name="{_escape(name)}"'
+            lines.append(f'{prefix}_span_seconds_sum{{{labels}}} {duration:.6f}')
+            lines.append(f'{prefix}_span_seconds_count{{{labels}}} {count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class _NoopTracer(Tracer):
+    @contextmanager
+    def span(self, name, category='compute', **attrs):
+        yield
+
+    def count(self, name, value=1):
+        pass
+
+
+NOOP = _NoopTracer()
+
+
+def current():
+    # Tracer of the running script (or one that records nothing)
+    return _current.get() or NOOP
+
+
+def activate(tracer):
+    _current.set(tracer)
+    return tracer
+
+
+class TracedSpotify:
+    """Wraps a spotipy.Spotify client and records a span for every API call, and 429s it ran into."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def traced_call(*args, **kwargs):
+            tracer = current()
+            tracer.count('api_calls')
+            with tracer.span(name, 'api'):
+                try:
+                    return attr(*args, **kwargs)
+                except SpotifyException as e:
+                    if e.http_status == 429:
+                        tracer.count('rate_limited')
+                    raise
+
+        return traced_call
+
+
+CATEGORY_COLORS = {'tab': '#1DB954', 'compute': '#ff7f0e', 'render': '#17becf', 'fetch': '#1f77b4', 'api': '#9467bd'}
+
+
+def render_timing_panel(tracer, container):
+    """Collapsible timing waterfall, counters and exports for one script run, e.g. in st.sidebar."""
+    import plotly.graph_objects as go
+
+    panel = container.expander("Timing")
+    spans = sorted(tracer.spans, key=lambda span: span['start'])
+    total = max((span['start'] + span['duration'] for span in spans), default=0.0)
+
+    col1, col2, col3 = panel.columns(3)
+    col1.metric("Run", f"{total * 1000:.0f} ms")
+    col2.metric("API calls", tracer.counters['api_calls'])
+    col3.metric("Cache hits", tracer.counters['cache_hits'])
+    if tracer.counters['rate_limited'] or tracer.counters['rate_limit_retries']:
+        panel.caption(f"Rate limited {tracer.counters['rate_limited']} times, "
+                      f"{tracer.counters['rate_limit_retries']} retries, "
+                      f"{tracer.counters['stale_served']} stale responses served")
+
+    if spans:
+        fig = go.Figure(go.Bar(
+            y=[f"{span['category']}: {span['name']}" for span in spans],
+            x=[span['duration'] * 1000 for span in spans],
+            base=[span['start'] * 1000 for span in spans],
+            orientation='h',
+            marker_color=[CATEGORY_COLORS.get(span['category'], '#7f7f7f') for span in spans],
+            hovertext=[span['thread'] for span in spans],
+        ))
+        fig.update_layout(xaxis_title='ms', yaxis={'autorange': 'reversed'},
+                          height=max(200, 18 * len(spans)), margin={'l': 0, 'r': 0, 't': 10, 'b': 0})
+        panel.plotly_chart(fig, use_container_width=True)
+
+    panel.download_button("Spans (JSON lines)", tracer.to_jsonl(), file_name='spans.jsonl')
+    panel.download_button("Metrics (Prometheus)", tracer.to_prometheus(), file_name='metrics.prom')
@@ -1,10 +1,9 @@
 from dotenv import load_dotenv
 import os
-import base64
-from requests import post, get
-import json
 import pandas as pd
 import streamlit as st
+from spotify_http import session, get_token_manager
+from artist_search import artist_search
 
 
 # Load environment variables
@@ -23,21 +22,8 @@ client_secret = get_env("CLIENT_SECRET")
 redirect_uri = get_env("REDIRECT_URI")
 
 def get_token():
-    auth_string = client_id + ":" + client_secret
-    auth_bytes = auth_string.encode('utf-8')
-    auth_base64 = str(base64.b64encode(auth_bytes), 'utf-8')
-    
-    url = "https://accounts.spotify.com/api/token"
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {"grant_type": "client_credentials"}
-    
-    result = post(url, headers=headers, data=data)
-    json_result = json.loads(result.content)
-    token = json_result["access_token"]
-    return token
+    # Cached for the whole process and refreshed shortly before it expires
+    return get_token_manager(client_id, client_secret).get()
 
 def get_auth_header(token):
     return {"Authorization": "Bearer " + token}
@@ -45,22 +31,21 @@ def get_auth_header(token):
 def search_for_artist(artist_name, token):
     url = "https://api.spotify.com/v1/search"
     headers = get_auth_header(token)
-    query = f'q={artist_name}&type=artist&limit=1'
+    params = {"q": artist_name, "type": "artist", "limit": 1}
     
-    query_url = url + "?" + query
-    result = get(query_url, headers=headers)
-    json_result = json.loads(result.content)["artists"]["items"]
+    # Shared keep-alive session, no new TLS handshake per search
+    result = session.get(url, headers=headers, params=params, timeout=10)
+    json_result = result.json()["artists"]["items"]
     
     return json_result
 
 def get_songs_by_artist(artist_id, token):
     url = f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks"
     headers = get_auth_header(token)
-    query = "market=US"
+    params = {"market": "US"}
     
-    query_url = url + "?" + query
-    result = get(query_url, headers=headers)
-    json_result = json.loads(result.content)["tracks"]
+    result = session.get(url, headers=headers, params=params, timeout=10)
+    json_result = result.json()["tracks"]
     
     return json_result
  
@@ -72,9 +57,11 @@ def main():
     artist_name = st.text_input("Enter artist name:")
     
     if artist_name:
-        token = get_token()
-        result = search_for_artist(artist_name, token)   #result is a list of dictionaries of artist with artist_name
-        top_artist=result[0]
+        # Served from the shared cache / known artists when possible, Spotify is only asked on a miss
+        top_artist = artist_search.find_artist(artist_name, lambda: search_for_artist(artist_name, get_token()))
+        if top_artist is None:
+            st.warning(f"No artist found for '{artist_name}'")
+            return
         
         df = pd.DataFrame([{
             'Name': top_artist['name'],
@@ -87,7 +74,7 @@ def main():
     
         st.write("Top tracks:")
         artist_id = top_artist["id"]
-        top_tracks = get_songs_by_artist(artist_id, token)
+        top_tracks = artist_search.top_tracks(artist_id, lambda: get_songs_by_artist(artist_id, get_token()))
         
         df = pd.DataFrame([{
             'Name': track['name'],
@@ -0,0 +1,37 @@
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import MultiLabelBinarizer
+
+
+NUMERICAL_FEATURES = ['popularity', 'duration_ms', 'explicit']
+
+
+def build_features(df, genre_names=None):
+    """Feature matrix for clustering tracks: numerical columns followed by one-hot genres.
+
+    Genres are encoded in a single pass into a sparse CSR matrix (tracks x genres), so the cost
+    grows with the number of (track, genre) pairs rather than tracks x genres. Pass genre_names
+    to get the genre columns in a fixed order (e.g. the one a model was fitted with).
+    Returns (X, genre_matrix, genre_names), X being sparse CSR.
+    """
+    encoder = MultiLabelBinarizer(classes=genre_names, sparse_output=True)
+    genre_matrix = encoder.fit_transform(df['genres']).tocsr().astype(np.float64)
+    numeric = sparse.csr_matrix(df[NUMERICAL_FEATURES].to_numpy(dtype=np.float64))
+    X = sparse.hstack([numeric, genre_matrix], format='csr')
+    X.sort_indices()
+    return X, genre_matrix, encoder.classes_
+
+
+def cluster_genre_counts(labels, genre_matrix, n_clusters):
+    # (clusters x tracks) membership matrix times (tracks x genres) gives genre counts per cluster
+    labels = np.asarray(labels)
+    membership = sparse.csr_matrix(
+        (np.ones(len(labels)), (labels, np.arange(len(labels)))),
+        shape=(n_clusters, len(labels)))
+    return (membership @ genre_matrix).toarray()
+
+
+def top_genres(counts, genre_names, n=5):
+    # [(genre, count), ...] for the n biggest non-zero counts of one cluster
+    order = np.argsort(-counts, kind='stable')[:n]
+    return [(genre_names[i], int(counts[i])) for i in order if counts[i] > 0]
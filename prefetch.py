@@ -0,0 +1,85 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from spotipy.exceptions import SpotifyException
+
+import instrumentation
+from rate_limit import RateLimited, RetriesExhausted
+
+
+# Bounded so one page load can't open dozens of connections to Spotify
+MAX_WORKERS = 8
+MAX_RETRIES = 3
+BASE_RETRY_DELAY = 1.0
+
+
+def with_backoff(fetch, retries=MAX_RETRIES, base_delay=BASE_RETRY_DELAY):
+    # Retry rate limited (429) calls, waiting for Retry-After when Spotify sends it
+    for attempt in range(retries + 1):
+        try:
+            return fetch()
+        except SpotifyException as e:
+            # RateLimited means the shared budget is exhausted, retrying would only queue up more requests,
+            # and RetriesExhausted comes from a client (spotify_async) that already retried
+            if e.http_status != 429 or isinstance(e, (RateLimited, RetriesExhausted)) or attempt == retries:
+                raise
+            instrumentation.current().count('rate_limit_retries')
+            retry_after = (e.headers or {}).get('Retry-After')
+            time.sleep(float(retry_after) if retry_after else base_delay * 2 ** attempt)
+
+
+class Prefetched:
+    """Results of a prefetch run. get() returns the value or re-raises the error of that fetch."""
+
+    def __init__(self):
+        self._values = {}
+        self._errors = {}
+
+    def ok(self, name):
+        return name in self._values
+
+    def done(self, name):
+        # Fetched, successfully or not
+        return name in self._values or name in self._errors
+
+    def get(self, name):
+        if name in self._errors:
+            raise self._errors[name]
+        return self._values[name]
+
+    def set(self, name, value):
+        self._values[name] = value
+        self._errors.pop(name, None)
+
+    def update(self, other):
+        self._values.update(other._values)
+        self._errors.update(other._errors)
+
+
+def _traced_fetch(name, fetch):
+    with instrumentation.current().span(name, 'fetch'):
+        return with_backoff(fetch)
+
+
+def prefetch(fetches, max_workers=MAX_WORKERS):
+    """Run every zero-argument callable in `fetches` (name -> callable) concurrently.
+
+    A failing fetch never cancels the others, its exception is kept and raised by get(name).
+    """
+    results = Prefetched()
+    if not fetches:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(fetches))) as pool:
+        # Each fetch runs in a copy of our context so it reports to the same tracer
+        futures = {pool.submit(contextvars.copy_context().run, _traced_fetch, name, fetch): name
+                   for name, fetch in fetches.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results._values[name] = future.result()
+            except Exception as e:
+                results._errors[name] = e
+
+    return results
@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from spotipy.exceptions import SpotifyException
+
+
+# Spotify doesn't publish its limit (it's a rolling 30 second window per app), stay well under it
+REQUESTS_PER_SECOND = float(os.getenv('SPOTIFY_REQUESTS_PER_SECOND', 10))
+BURST = int(os.getenv('SPOTIFY_REQUEST_BURST', 20))
+# Tokens background requests always leave for requests of the section someone is looking at
+INTERACTIVE_RESERVE = int(os.getenv('SPOTIFY_INTERACTIVE_RESERVE', 5))
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+# Longest a request queues for its turn before it's failed as rate limited (and stale data served instead)
+MAX_WAIT = {INTERACTIVE: 5.0, BACKGROUND: 60.0}
+
+_priority = contextvars.ContextVar('request_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    # Requests made inside (including from prefetch threads started inside) queue at this priority
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class RateLimited(SpotifyException):
+    """Raised without calling Spotify when the request budget wouldn't allow it within MAX_WAIT."""
+
+    def __init__(self, retry_after):
+        super().__init__(429, -1, f"Too many requests, try again in {math.ceil(retry_after)}s",
+                         headers={'Retry-After': str(math.ceil(retry_after))})
+
+
+class RetriesExhausted(SpotifyException):
+    """A 429 from Spotify that the client already waited out and retried as often as it may.
+    Nothing should retry it again on top."""
+
+
+class TokenBucket:
+    """Request budget for the whole process: `rate` requests per second, bursts of up to `capacity`.
+
+    Interactive callers reserve a token and wait for it, so they go out in the order they asked.
+    Background requests only get a token while `reserve` are left for interactive ones,
+    pause() stops everyone until a Retry-After has passed, and a request that would have to wait
+    longer than MAX_WAIT for its priority raises RateLimited instead of queueing.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, capacity=BURST, reserve=INTERACTIVE_RESERVE, max_wait=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = min(reserve, capacity - 1)
+        self.max_wait = MAX_WAIT if max_wait is None else max_wait
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self, level, waited):
+        # (how long to wait, whether a token was taken). Interactive requests reserve a token that may
+        # only become available later, background ones only take one that's free now and otherwise
+        # come back after the wait, so interactive requests arriving meanwhile go first.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            floor = self.reserve if level == BACKGROUND else 0
+            wait = max((floor + 1 - self._tokens) / self.rate, self._paused_until - now, 0.0)
+            if waited + wait > self.max_wait.get(level, math.inf):
+                raise RateLimited(wait)
+            if level == BACKGROUND and wait > 0:
+                return wait, False
+            self._tokens -= 1
+            return wait, True
+
+    async def acquire_async(self, level=None):
+        level = level or current_priority()
+        waited = 0.0
+        while True:
+            wait, taken = self._take(level, waited)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                waited += wait
+            if taken:
+                return waited
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# Module level, shared by every session of the app
+bucket = TokenBucket()
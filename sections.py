@@ -0,0 +1,180 @@
+import contextvars
+import functools
+import threading
+import time
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import instrumentation
+import rate_limit
+from prefetch import Prefetched, prefetch
+from spotify_cache import _freeze
+
+
+# Default time a section's computed result is reused within the session
+DEFAULT_SECTION_TTL = 5 * 60
+
+
+class DataSource:
+    """A named piece of data, fetched with fetch(ctx, data) once everything in `needs` is available."""
+
+    def __init__(self, fetch, needs=()):
+        self.fetch = fetch
+        self.needs = tuple(needs)
+
+
+class Section:
+    """One page of the dashboard.
+
+    `needs` names the data sources it reads, `compute(ctx, data, **params)` turns them into what
+    `render(ctx, data, result, **params)` shows, and `controls(ctx)` draws any widgets the
+    computation depends on and returns their values as params. Nothing runs until the section
+    is opened, and computed results are memoized for the session per params.
+    `snapshot_params` lists the params sync_worker.py precomputes (by default only a section
+    without controls is precomputed).
+    """
+
+    def __init__(self, title, needs, render, compute=None, controls=None, error_message=None,
+                 ttl=DEFAULT_SECTION_TTL, snapshot_params=None):
+        self.title = title
+        self.needs = tuple(needs)
+        self.render = render
+        self.compute = compute
+        self.controls = controls
+        self.error_message = error_message or f"Error in {title}"
+        self.ttl = ttl
+        if snapshot_params is None:
+            snapshot_params = [] if controls else [{}]
+        self.snapshot_params = snapshot_params if compute else []
+
+
+class _NoProgress:
+    # Stands in for st.progress where nobody is watching
+    def progress(self, *args, **kwargs):
+        pass
+
+    def empty(self):
+        pass
+
+
+def progress(*args, **kwargs):
+    """st.progress, drawn only from the script run or a fetch it waits for (see resolve), so the
+    background warm-up and sync_worker.py get a progress bar that draws nothing."""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return _NoProgress()
+    return st.progress(*args, **kwargs)
+
+
+def _in_script_run(fetch, script_ctx):
+    # Runs fetch on a prefetch thread attached to the script run, so what it draws lands on the page
+    def run():
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+        return fetch()
+    return run
+
+
+def section_key(section, params):
+    # Where a computed result is kept in the session cache
+    return ('section', section.title, _freeze(params))
+
+
+def resolve(names, sources, ctx, data=None):
+    """Fetch `names` and whatever they depend on. Independent sources are fetched concurrently,
+    one wave per dependency level. Sources already in `data` (fetched or failed) are skipped."""
+    data = data if data is not None else Prefetched()
+
+    wanted = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name in wanted or data.done(name):
+            continue
+        wanted.add(name)
+        stack.extend(sources[name].needs)
+
+    script_ctx = get_script_run_ctx(suppress_warning=True)
+    while wanted:
+        ready = [name for name in wanted if not any(dep in wanted for dep in sources[name].needs)]
+        fetches = {name: functools.partial(sources[name].fetch, ctx, data) for name in ready}
+        if script_ctx is not None:
+            fetches = {name: _in_script_run(fetch, script_ctx) for name, fetch in fetches.items()}
+        data.update(prefetch(fetches))
+        wanted.difference_update(ready)
+    return data
+
+
+def run_section(section, sources, ctx, data):
+    tracer = instrumentation.current()
+    with tracer.span(section.title, 'tab'):
+        try:
+            params = section.controls(ctx) if section.controls else {}
+            resolve(section.needs, sources, ctx, data)
+
+            result = None
+            if section.compute:
+                with tracer.span(f'{section.title} compute'):
+                    result = ctx.cache.get_or_compute(
+                        section_key(section, params), section.ttl,
+                        lambda: section.compute(ctx, data, **params))
+
+            with tracer.span(f'{section.title} render', 'render'):
+                section.render(ctx, data, result, **params)
+        except Exception as e:
+            st.error(f"{section.error_message}: {str(e)}")
+
+
+def take_snapshot(sections, sources, ctx):
+    """Fetch every source and compute every section's snapshot_params, for storing with
+    history_db.save_snapshot(). Sources or sections that fail are left out."""
+    data = resolve(list(sources), sources, ctx)
+    results = {}
+    for section in sections:
+        for params in section.snapshot_params:
+            try:
+                results[section_key(section, params)] = section.compute(ctx, data, **params)
+            except Exception:
+                continue
+    return {
+        'sources': {name: data.get(name) for name in sources if data.ok(name)},
+        'results': results,
+    }
+
+
+def apply_snapshot(snapshot, computed_at, data, cache, max_age):
+    # Serve a stored snapshot as if it had just been fetched and computed, until it's max_age old
+    ttl = computed_at + max_age - time.time()
+    if ttl <= 0:
+        return
+    for name, value in snapshot['sources'].items():
+        if not data.done(name):
+            data.set(name, value)
+    for key, result in snapshot['results'].items():
+        if cache.get(key) is None:
+            cache.set(key, result, ttl)
+
+
+def warm(sections, sources, ctx, data):
+    """Fetch the data of `sections` on a background thread, so opening them later is instant.
+
+    Runs at background priority, so it only uses rate limit budget the open section leaves over.
+    Results land in the caches the sources go through, nothing is computed or rendered.
+    """
+    names = [name for section in sections for name in section.needs]
+    background = Prefetched()
+    background.update(data)
+
+    def run():
+        with rate_limit.priority(rate_limit.BACKGROUND):
+            resolve(names, sources, ctx, background)
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), name='warm-sections', daemon=True)
+    thread.start()
+    return thread
+
+
+def navigation(sections, key='section'):
+    # Only the chosen section runs, unlike st.tabs which executes every tab body on each rerun
+    titles = [section.title for section in sections]
+    title = st.radio("Section", titles, horizontal=True, label_visibility='collapsed', key=key)
+    return sections[titles.index(title)]
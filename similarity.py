@@ -0,0 +1,202 @@
+"""Track similarity index behind "Other Tracks You Might Like".
+
+Every track in the stored listening history (all users) and in the users' libraries is a row
+of a sparse track x feature matrix: popularity, duration, explicit and play count scaled to 0..1,
+plus one column per artist genre. Rows are L2-normalized, so a user's recommendations are one
+sparse matrix-vector product of the matrix with their normalized taste vector (the sum of
+the rows they played or saved) - cosine similarity for every track at once, no API calls.
+
+Nothing but artist genres is stored for the index: tracks and plays come from listening_history,
+saved tracks from the saved_tracks table the Library source stores. Each process (the dashboard,
+sync_worker.py) keeps its own copy and only reads what was added since its last update, the
+first update reads the history grouped per track in SQL. Genres are looked up (artist_genres
+table, then the API) for artists it hasn't seen before.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from scipy import sparse
+
+import history_db
+
+
+# Longest duration told apart, anything longer is as long as this
+MAX_DURATION_MS = 10 * 60 * 1000
+# Play counts (all users) are log-scaled so this many plays fills the column
+MAX_PLAYS = 1000
+# Weight of a saved (but maybe never played) track in the taste vector, a play counts 1
+SAVED_WEIGHT = 1.0
+# Tracks the user played this recently aren't recommended
+RECENT_DAYS = 30
+DEFAULT_LIMIT = 20
+
+
+def _empty_user():
+    # row -> play count, row -> last played_at, rows of saved tracks
+    return {'plays': {}, 'last_played': {}, 'saved': set()}
+
+
+class SimilarityIndex:
+    """Sparse L2-normalized track features and the per-user plays / saves the taste vectors come from."""
+
+    def __init__(self):
+        self.track_ids = []
+        self.rows = {}
+        # row -> dict of name, artist, artist_id, popularity, duration_ms, explicit
+        self.tracks = []
+        self.plays = []
+        self.genre_columns = {}
+        # artist id -> genre column numbers, for every artist looked up so far
+        self.artist_genres = {}
+        self.users = {}
+        # Last listening_history rowid, and user_id -> history_db.library_changes() time, read so far
+        self.indexed_rowid = 0
+        self.library_changed_at = {}
+        self.matrix = None
+        self._lock = threading.Lock()
+        # Held for a whole update(), so two threads don't read the same new plays
+        self._update_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def _row(self, track_id, name, artist_id, artist, popularity, duration_ms, explicit):
+        # Adds the track, or refreshes what may change (popularity) of one already indexed
+        row = self.rows.get(track_id)
+        if row is None:
+            row = self.rows[track_id] = len(self.track_ids)
+            self.track_ids.append(track_id)
+            self.tracks.append({'name': name, 'artist': artist, 'artist_id': artist_id,
+                                'popularity': popularity, 'duration_ms': duration_ms, 'explicit': explicit})
+            self.plays.append(0)
+        elif popularity is not None:
+            self.tracks[row]['popularity'] = popularity
+        return row
+
+    def update(self, conn, genres):
+        """Read the plays stored since the last update and the saved tracks of users whose library
+        changed, look up genres of new artists with genres(artist_ids) (ArtistResolver.genres) and
+        rebuild the matrix if anything changed. Returns whether it did."""
+        with self._update_lock:
+            return self._update(conn, genres)
+
+    def _update(self, conn, genres):
+        # Everything is read and looked up first and applied in one step with the rebuild, so
+        # recommend() never sees rows the matrix doesn't have (nor half an update if genres() fails)
+        through_rowid = history_db.last_play_rowid(conn)
+        tracks, plays = [], []
+        if through_rowid > self.indexed_rowid:
+            tracks = history_db.play_totals(conn, self.indexed_rowid, through_rowid)
+            plays = history_db.user_play_totals(conn, self.indexed_rowid, through_rowid)
+        libraries = {user_id: (changed_at, history_db.saved_tracks(conn, user_id))
+                     for user_id, changed_at in history_db.library_changes(conn).items()
+                     if self.library_changed_at.get(user_id) != changed_at}
+        if not tracks and not libraries:
+            self.indexed_rowid = max(self.indexed_rowid, through_rowid)
+            return False
+
+        new_artists = {track[2] for track in tracks}
+        new_artists.update(track[2] for _, saved in libraries.values() for track in saved)
+        new_artists = {artist_id for artist_id in new_artists if artist_id and artist_id not in self.artist_genres}
+        found = history_db.artist_genres(conn, new_artists)
+        missing = new_artists - found.keys()
+        if missing:
+            fetched = genres(missing)
+            history_db.save_artist_genres(conn, {artist_id: fetched[artist_id] for artist_id in missing
+                                                 if artist_id in fetched})
+            found.update({artist_id: fetched.get(artist_id, []) for artist_id in missing})
+
+        with self._lock:
+            for track_id, name, artist_id, artist, popularity, duration_ms, explicit, count in tracks:
+                row = self._row(track_id, name, artist_id, artist, popularity, duration_ms, explicit)
+                self.plays[row] += count
+            for user_id, track_id, count, last_played in plays:
+                row = self.rows[track_id]
+                user = self.users.setdefault(user_id, _empty_user())
+                user['plays'][row] = user['plays'].get(row, 0) + count
+                user['last_played'][row] = max(user['last_played'].get(row, ''), last_played)
+            for user_id, (changed_at, saved) in libraries.items():
+                self.users.setdefault(user_id, _empty_user())['saved'] = {self._row(*track) for track in saved}
+                self.library_changed_at[user_id] = changed_at
+            for artist_id, artist_genres in found.items():
+                self.artist_genres[artist_id] = [self.genre_columns.setdefault(genre, len(self.genre_columns))
+                                                 for genre in artist_genres]
+            self.indexed_rowid = max(self.indexed_rowid, through_rowid)
+            self._build()
+        return True
+
+    def _build(self):
+        # Called with the lock held
+        n = len(self.tracks)
+        popularity = np.array([track['popularity'] or 0 for track in self.tracks], dtype=np.float64) / 100
+        duration = np.array([track['duration_ms'] or 0 for track in self.tracks], dtype=np.float64)
+        explicit = np.array([track['explicit'] or 0 for track in self.tracks], dtype=np.float64)
+        plays = np.log1p(np.array(self.plays, dtype=np.float64)) / np.log1p(MAX_PLAYS)
+        numeric = np.column_stack([popularity, np.minimum(duration / MAX_DURATION_MS, 1.0), explicit,
+                                   np.minimum(plays, 1.0)])
+
+        genre_lists = [self.artist_genres.get(track['artist_id'], []) for track in self.tracks]
+        lengths = np.fromiter((len(columns) for columns in genre_lists), dtype=np.int64, count=n)
+        genre_rows = np.repeat(np.arange(n), lengths)
+        genre_cols = np.fromiter((column for columns in genre_lists for column in columns), dtype=np.int64,
+                                 count=int(lengths.sum()))
+        genre_matrix = sparse.csr_matrix((np.ones(len(genre_rows)), (genre_rows, genre_cols)),
+                                         shape=(n, len(self.genre_columns)))
+
+        matrix = sparse.hstack([sparse.csr_matrix(numeric), genre_matrix], format='csr')
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        self.matrix = sparse.diags(1 / norms) @ matrix
+
+    def taste_vector(self, user_id):
+        # Normalized sum of the rows the user played (weighted by plays) or saved, None without any
+        user = self.users.get(user_id)
+        if user is None or self.matrix is None:
+            return None
+        weights = np.zeros(self.matrix.shape[0])
+        for row, count in user['plays'].items():
+            weights[row] += count
+        for row in user['saved']:
+            weights[row] += SAVED_WEIGHT
+        vector = np.asarray(self.matrix.T @ weights).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def recommend(self, user_id, limit=DEFAULT_LIMIT, recent_days=RECENT_DAYS, now=None):
+        """Up to `limit` dicts (track_id, name, artist, popularity, similarity, your_plays), most similar
+        to the user's taste first, leaving out saved tracks and tracks played in the last recent_days."""
+        with self._lock:
+            query = self.taste_vector(user_id)
+            if query is None:
+                return []
+            scores = self.matrix @ query
+
+            user = self.users[user_id]
+            since = history_db.format_timestamp((now or datetime.now(timezone.utc)) - timedelta(days=recent_days))
+            excluded = [row for row, played_at in user['last_played'].items() if played_at >= since]
+            excluded.extend(user['saved'])
+            scores[excluded] = -np.inf
+
+            candidates = np.flatnonzero(np.isfinite(scores))
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+            return [{
+                'track_id': self.track_ids[row],
+                'name': self.tracks[row]['name'],
+                'artist': self.tracks[row]['artist'],
+                'popularity': self.tracks[row]['popularity'],
+                'similarity': float(scores[row]),
+                'your_plays': user['plays'].get(row, 0),
+            } for row in candidates]
+
+
+# The process-wide index, built from the database by its first update
+_shared = SimilarityIndex()
+
+
+def update_index(conn, genres):
+    # Bring the shared index up to date with the database, only what was added since the last update is read
+    _shared.update(conn, genres)
+    return _shared
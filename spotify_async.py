@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+
+import httpx
+from spotipy.exceptions import SpotifyException
+
+import instrumentation
+from rate_limit import RetriesExhausted, bucket as default_bucket
+from spotify_http import POOL_SIZE, TIMEOUT
+
+
+API_URL = 'https://api.spotify.com/v1/'
+# 429s retried inside the client, after waiting out Retry-After
+MAX_RETRIES = 3
+DEFAULT_RETRY_AFTER = 1
+
+
+class AsyncSpotify:
+    """asyncio client for the Spotify endpoints the dashboard uses.
+
+    Method names, arguments and responses match spotipy.Spotify, and errors are raised as
+    SpotifyException, so it can stand in for it (through SyncSpotify) anywhere in the app.
+    Every request takes a token from the process-wide rate limit bucket first, at the priority
+    set with rate_limit.priority().
+    """
+
+    def __init__(self, auth, http=None, bucket=None, max_retries=MAX_RETRIES):
+        self.auth = auth
+        self.prefix = API_URL
+        self._http = http
+        self.bucket = bucket or default_bucket
+        self.max_retries = max_retries
+
+    async def _get(self, path, params=None):
+        url = path if path.startswith('http') else self.prefix + path
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        http = self._http or _shared_http()
+
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire_async()
+            response = await http.get(url, params=params or None, headers={'Authorization': f'Bearer {self.auth}'})
+            if response.status_code == 429 and attempt < self.max_retries:
+                # Hold back every request in the process, not only this one
+                instrumentation.current().count('rate_limit_retries')
+                self.bucket.pause(float(response.headers.get('Retry-After') or DEFAULT_RETRY_AFTER))
+                continue
+            if response.status_code >= 400:
+                try:
+                    message = response.json()['error']['message']
+                except (ValueError, KeyError, TypeError):
+                    message = response.text
+                # 429s are only retried here, prefetch.with_backoff leaves RetriesExhausted alone
+                error = RetriesExhausted if response.status_code == 429 else SpotifyException
+                # httpx.Headers, so e.headers.get('Retry-After') works whatever the case Spotify sent
+                raise error(response.status_code, -1, f'{response.url}:\n {message}', headers=response.headers)
+            return response.json() if response.content else None
+
+    async def next(self, result):
+        return await self._get(result['next']) if result and result.get('next') else None
+
+    async def current_user(self):
+        return await self._get('me')
+
+    async def current_user_top_tracks(self, limit=20, offset=0, time_range='medium_term'):
+        return await self._get('me/top/tracks', {'limit': limit, 'offset': offset, 'time_range': time_range})
+
+    async def current_user_top_artists(self, limit=20, offset=0, time_range='medium_term'):
+        return await self._get('me/top/artists', {'limit': limit, 'offset': offset, 'time_range': time_range})
+
+    async def current_user_recently_played(self, limit=50, after=None, before=None):
+        return await self._get('me/player/recently-played', {'limit': limit, 'after': after, 'before': before})
+
+    async def current_user_saved_tracks(self, limit=20, offset=0, market=None):
+        return await self._get('me/tracks', {'limit': limit, 'offset': offset, 'market': market})
+
+    async def current_user_saved_albums(self, limit=20, offset=0, market=None):
+        return await self._get('me/albums', {'limit': limit, 'offset': offset, 'market': market})
+
+    async def current_user_playlists(self, limit=50, offset=0):
+        return await self._get('me/playlists', {'limit': limit, 'offset': offset})
+
+    async def artist(self, artist_id):
+        return await self._get(f'artists/{artist_id}')
+
+    async def artists(self, artists):
+        return await self._get('artists', {'ids': ','.join(artists)})
+
+    async def artist_top_tracks(self, artist_id, country='US'):
+        return await self._get(f'artists/{artist_id}/top-tracks', {'country': country})
+
+
+# -- sync bridge --
+
+_loop = None
+_http = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop():
+    # One event loop thread per process runs every session's requests
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='spotify-async', daemon=True).start()
+        return _loop
+
+
+def _shared_http():
+    # Only ever called on the event loop thread, so no lock needed
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE))
+    return _http
+
+
+async def _in_context(context, coroutine):
+    # Tasks start from the loop thread's context, take the caller's (tracer, request priority) instead
+    for var, value in context.items():
+        var.set(value)
+    return await coroutine
+
+
+def run(coroutine):
+    """Run a coroutine on the shared event loop and block until it's done, from any thread."""
+    return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coroutine),
+                                            _event_loop()).result()
+
+
+class SyncSpotify:
+    """Blocking facade over AsyncSpotify for code written against spotipy.Spotify
+    (CachedSpotify, TracedSpotify, iter_pages, prefetch threads). The calling thread only
+    waits, the requests of every session share the one event loop and connection pool."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not inspect.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return run(attr(*args, **kwargs))
+
+        return call
+
+
+def create_client(access_token):
+    return SyncSpotify(AsyncSpotify(access_token))
@@ -0,0 +1,253 @@
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from spotipy.exceptions import SpotifyException
+
+import instrumentation
+
+
+# How long (in seconds) a response from each endpoint stays fresh.
+# Only read-only endpoints listed here are cached, everything else goes straight to Spotify.
+ENDPOINT_TTLS = {
+    'current_user': 60 * 60,
+    'current_user_top_tracks': 60 * 60,
+    'current_user_top_artists': 60 * 60,
+    'current_user_recently_played': 60,
+    'current_user_saved_tracks': 10 * 60,
+    'current_user_saved_albums': 10 * 60,
+    'current_user_playlists': 10 * 60,
+    # artists (batches of IDs) isn't cached, the batches hardly repeat and spotify_data.ArtistResolver
+    # keeps every artist it fetched under its own ID
+    'artist': 24 * 60 * 60,
+    'artist_top_tracks': 24 * 60 * 60,
+    'track': 24 * 60 * 60,
+    'tracks': 24 * 60 * 60,
+}
+
+# Catalog lookups answer the same for every user, so they go to the process-wide shared cache
+# (when CachedSpotify has one) instead of each session's own
+SHARED_ENDPOINTS = {'artist', 'artist_top_tracks', 'track', 'tracks'}
+
+# Upper bound on cached entries kept for one user
+MAX_ENTRIES_PER_USER = 4096
+# Upper bound on artists / tracks / top tracks kept in memory for all users together
+MAX_SHARED_ENTRIES = 50000
+# How often PersistentCache drops expired rows and trims its table to max_entries (of the longest lived)
+PURGE_INTERVAL = 10 * 60
+
+_MISSING = object()
+
+
+def _freeze(value):
+    # Turn lists/dicts in call arguments into something hashable
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class ResponseCache:
+    """LRU cache of API responses where every entry carries its own expiry time."""
+
+    def __init__(self, max_entries=MAX_ENTRIES_PER_USER):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                # Expired entries stay (until LRU evicts them) for get_stale()
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_stale(self, key, default=None):
+        # The last value stored for key even if it expired, for when fetching a fresh one failed
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, ttl, compute):
+        # For derived data (aggregates etc.) that should be cached like an API response
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PersistentCache(ResponseCache):
+    """ResponseCache that also writes every entry to a SQLite table (when given a db_path),
+    so entries survive restarts. Keys and values must be JSON serializable."""
+
+    def __init__(self, max_entries=MAX_SHARED_ENTRIES, db_path=None):
+        super().__init__(max_entries)
+        self.db_path = db_path
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._next_purge = 0
+
+    def _connection(self):
+        # Opened on first use and shared by all threads, callers hold _db_lock
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            with self._db:
+                self._db.execute("""CREATE TABLE IF NOT EXISTS metadata_cache
+                                    (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)""")
+        if time.monotonic() >= self._next_purge:
+            self._purge(self._db)
+        return self._db
+
+    def _purge(self, db):
+        # Bounded like the in-memory LRU: expired rows go, then the ones expiring soonest beyond max_entries
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+        with db:
+            db.execute("DELETE FROM metadata_cache WHERE expires_at < ?", (time.time(),))
+            db.execute("""DELETE FROM metadata_cache WHERE key IN
+                          (SELECT key FROM metadata_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)""",
+                       (self.max_entries,))
+
+    def get(self, key, default=None):
+        value = super().get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self.db_path:
+            return default
+
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM metadata_cache WHERE key = ? AND expires_at > ?",
+                (json.dumps(key), time.time())).fetchone()
+        if row is None:
+            return default
+        value = json.loads(row[0])
+        super().set(key, value, row[1] - time.time())
+        return value
+
+    def set(self, key, value, ttl):
+        super().set(key, value, ttl)
+        if self.db_path:
+            with self._db_lock:
+                db = self._connection()
+                with db:
+                    db.execute("INSERT OR REPLACE INTO metadata_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                               (json.dumps(key), json.dumps(value), time.time() + ttl))
+
+    def clear(self):
+        super().clear()
+        if self.db_path:
+            with self._db_lock:
+                db = self._connection()
+                with db:
+                    db.execute("DELETE FROM metadata_cache")
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    """The process-wide cache for catalog data (artists, tracks), shared by every session.
+
+    Persisted to the history database (history_db.DB_PATH), or to $SPOTIFY_METADATA_DB
+    (set it empty to keep it in memory only).
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            import history_db
+            db_path = os.getenv('SPOTIFY_METADATA_DB', history_db.DB_PATH) or None
+            if db_path == history_db.DB_PATH:
+                # Creates it (from the committed seed) on first run
+                history_db.connect().close()
+            _shared = PersistentCache(db_path=db_path)
+        return _shared
+
+
+class CachedSpotify:
+    """Wraps a spotipy.Spotify client and memoizes read-only endpoints.
+
+    Calls are keyed by endpoint name plus the fully bound arguments (defaults included),
+    so sp.current_user_top_tracks(limit=20) and sp.current_user_top_tracks(20, 0, 'medium_term')
+    share one entry. SHARED_ENDPOINTS go to `shared_cache` when one is given, everything else stays
+    in the per-user `cache`. When a call is rate limited the expired entry is served if there is
+    one. Cached responses are shared between callers, treat them as read-only.
+    """
+
+    def __init__(self, client, cache, ttls=None, shared_cache=None):
+        self._client = client
+        self._cache = cache
+        self._shared = shared_cache
+        self._ttls = ENDPOINT_TTLS if ttls is None else ttls
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._ttls or not callable(attr):
+            return attr
+
+        signature = inspect.signature(attr)
+        ttl = self._ttls[name]
+        cache = self._shared if name in SHARED_ENDPOINTS and self._shared is not None else self._cache
+
+        def cached_call(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (name, _freeze(bound.arguments))
+
+            result = cache.get(key, _MISSING)
+            if result is not _MISSING:
+                instrumentation.current().count('cache_hits')
+                return result
+
+            instrumentation.current().count('cache_misses')
+            try:
+                result = attr(*args, **kwargs)
+            except SpotifyException as e:
+                # Rate limited: an outdated answer beats an error
+                result = cache.get_stale(key, _MISSING) if e.http_status == 429 else _MISSING
+                if result is _MISSING:
+                    raise
+                instrumentation.current().count('stale_served')
+                return result
+            cache.set(key, result, ttl)
+            return result
+
+        cached_call.__name__ = name
+        return cached_call
@@ -0,0 +1,94 @@
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from prefetch import with_backoff
+from spotify_cache import ENDPOINT_TTLS
+
+
+# Spotify's several-artists endpoint accepts at most 50 IDs per request
+ARTISTS_BATCH_SIZE = 50
+
+_MISSING = object()
+
+
+class ArtistResolver:
+    """Resolves artist IDs to full artist objects (genres etc.) with as few requests as possible.
+
+    Artists are kept one entry per ID in `cache`, so an artist seen by one section
+    (for example in the top artists response) is never fetched again by another. Given the
+    process-wide spotify_cache.shared_cache(), that holds across users too.
+    """
+
+    def __init__(self, sp, cache, ttl=ENDPOINT_TTLS['artist']):
+        self.sp = sp
+        self.cache = cache
+        self.ttl = ttl
+
+    def prime(self, artists):
+        # Store artist objects we already have from another response (once per TTL, the
+        # shared cache writes every set through to SQLite)
+        for artist in artists:
+            if artist and self.cache.get(('artist_by_id', artist['id']), _MISSING) is _MISSING:
+                self.cache.set(('artist_by_id', artist['id']), artist, self.ttl)
+
+    def resolve(self, artist_ids):
+        artists = {}
+        missing = []
+        for artist_id in dict.fromkeys(artist_ids):  # dedupe but keep order
+            artist = self.cache.get(('artist_by_id', artist_id), _MISSING)
+            if artist is _MISSING:
+                missing.append(artist_id)
+            else:
+                artists[artist_id] = artist
+
+        for start in range(0, len(missing), ARTISTS_BATCH_SIZE):
+            batch = missing[start:start + ARTISTS_BATCH_SIZE]
+            fetched = [artist for artist in self.sp.artists(batch)['artists'] if artist]
+            for artist in fetched:
+                self.cache.set(('artist_by_id', artist['id']), artist, self.ttl)
+            artists.update((artist['id'], artist) for artist in fetched)
+
+        return artists
+
+    def genres(self, artist_ids):
+        # Map artist ID -> list of genres (empty when Spotify has none)
+        return {artist_id: artist.get('genres') or []
+                for artist_id, artist in self.resolve(artist_ids).items()}
+
+
+# Largest page size the library and playlist endpoints allow
+PAGE_SIZE = 50
+# How many pages are fetched ahead of the one being consumed
+PAGES_AHEAD = 4
+
+
+def iter_pages(fetch_page, page_size=PAGE_SIZE, pages_ahead=PAGES_AHEAD):
+    """Yield every page of an offset-paginated endpoint, e.g. sp.current_user_saved_tracks.
+
+    The first page tells us `total`, after that up to `pages_ahead` pages are requested concurrently
+    while the caller works on the current one. Pages come out in order and only the pages in flight
+    are held in memory.
+    """
+    first = with_backoff(lambda: fetch_page(limit=page_size, offset=0))
+    yield first
+
+    offsets = iter(range(page_size, first['total'], page_size))
+    with ThreadPoolExecutor(max_workers=pages_ahead) as pool:
+        def submit(offset):
+            return pool.submit(contextvars.copy_context().run,
+                               with_backoff, lambda: fetch_page(limit=page_size, offset=offset))
+
+        pending = deque(submit(offset) for offset in islice(offsets, pages_ahead))
+        while pending:
+            page = pending.popleft().result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(submit(next_offset))
+            yield page
+
+
+def iter_items(fetch_page, page_size=PAGE_SIZE, pages_ahead=PAGES_AHEAD):
+    for page in iter_pages(fetch_page, page_size, pages_ahead):
+        yield from page['items']
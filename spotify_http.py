@@ -0,0 +1,83 @@
+import base64
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+# What the dashboard's user login asks for
+SCOPE = (
+    "user-read-private "
+    "user-read-email "
+    "user-read-recently-played "
+    "user-top-read "
+    "user-library-read "
+    "user-follow-read "
+    "playlist-read-private "
+    "user-read-currently-playing "
+    "user-read-playback-state"
+)
+# Connections kept alive per host, shared by every session of the app
+POOL_SIZE = 20
+# Refresh the token this many seconds before Spotify says it expires
+REFRESH_MARGIN = 60
+TIMEOUT = 10
+
+
+def create_session(pool_size=POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+# Module level so it survives Streamlit reruns (the script is re-executed, imported modules are not)
+session = create_session()
+
+
+class ClientCredentialsToken:
+    """Client-credentials access token, fetched once and reused until shortly before it expires."""
+
+    def __init__(self, client_id, client_secret, http=None, refresh_margin=REFRESH_MARGIN):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.http = http or session
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at - self.refresh_margin:
+                self._refresh()
+            return self._token
+
+    def _refresh(self):
+        auth_string = self.client_id + ":" + self.client_secret
+        auth_base64 = str(base64.b64encode(auth_string.encode('utf-8')), 'utf-8')
+        headers = {
+            "Authorization": "Basic " + auth_base64,
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        result = self.http.post(TOKEN_URL, headers=headers, data={"grant_type": "client_credentials"},
+                                timeout=TIMEOUT)
+        result.raise_for_status()
+        json_result = result.json()
+        self._token = json_result["access_token"]
+        self._expires_at = time.monotonic() + json_result.get("expires_in", 3600)
+
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def get_token_manager(client_id, client_secret):
+    # One token per set of credentials for the whole process
+    with _tokens_lock:
+        key = (client_id, client_secret)
+        if key not in _tokens:
+            _tokens[key] = ClientCredentialsToken(client_id, client_secret)
+        return _tokens[key]
@@ -0,0 +1,130 @@
+"""Precompute the dashboard for every user who logged in, so pages open from a ready snapshot.
+
+    python sync_worker.py --once
+    python sync_worker.py --interval 3600
+
+Uses the refresh tokens main2.py stores at login and the dashboard's CLIENT_ID / CLIENT_SECRET /
+REDIRECT_URI (environment variables, or .streamlit/secrets.toml). For every user it syncs the
+listening history (and its Parquet export), records top artists for all three time ranges (once a day), and
+stores every section's computed result plus the track cluster assignments in the history database
+(computing the recommendations also brings the similarity index up to date).
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import spotipy
+import streamlit as st
+from spotipy.oauth2 import SpotifyOAuth
+
+import history_db
+import history_parquet
+import rate_limit
+import spotify_async
+from dashboard import SECTIONS, SOURCES
+from sections import progress, section_key, take_snapshot
+from spotify_cache import CachedSpotify, ResponseCache, shared_cache
+from spotify_http import SCOPE
+from spotify_data import ArtistResolver
+
+log = logging.getLogger('sync_worker')
+
+DEFAULT_INTERVAL = 60 * 60
+
+
+def _setting(name):
+    return os.getenv(name) or st.secrets[name]
+
+
+def create_oauth():
+    return SpotifyOAuth(
+        client_id=_setting('CLIENT_ID'),
+        client_secret=_setting('CLIENT_SECRET'),
+        redirect_uri=_setting('REDIRECT_URI'),
+        scope=SCOPE,
+        cache_handler=spotipy.cache_handler.MemoryCacheHandler(),
+    )
+
+
+def sync_user(conn, oauth, user_id, refresh_token):
+    token_info = oauth.refresh_access_token(refresh_token)
+    # Spotify may hand out a new refresh token, the old one stops working
+    if token_info.get('refresh_token'):
+        history_db.save_refresh_token(conn, user_id, token_info['refresh_token'])
+
+    cache = ResponseCache()
+    sp = CachedSpotify(spotify_async.create_client(token_info['access_token']), cache, shared_cache=shared_cache())
+    ctx = SimpleNamespace(sp=sp, cache=cache, artists=ArtistResolver(sp, shared_cache()), progress=progress)
+
+    started_at = time.time()
+    recorded_at = history_db.format_timestamp(datetime.now(timezone.utc))
+    # Also records the day's top artist ranks (the top_artist_ranks source)
+    snapshot = take_snapshot(SECTIONS, SOURCES, ctx)
+    if 'user' not in snapshot['sources']:
+        # Rate limited or offline, the previous snapshot is better than an empty one
+        raise RuntimeError("couldn't fetch the user's profile, keeping the previous snapshot")
+
+    ml_section = next(section for section in SECTIONS if section.title == "ML Analysis")
+    ml_result = snapshot['results'].get(section_key(ml_section, {}))
+    if ml_result is not None:
+        df = ml_result[0]
+        history_db.record_track_clusters(conn, user_id, zip(df['track_id'], df['Cluster']), recorded_at)
+
+    history_db.save_snapshot(conn, user_id, snapshot, started_at)
+    # Keep the columnar copy of the history in step for the analytics
+    history_parquet.export_history(conn, user_id)
+    return snapshot
+
+
+def sync_all(users=None):
+    """One pass over every stored user (or just `users`). Returns how many were attempted and synced."""
+    oauth = create_oauth()
+    attempted = synced = 0
+    with closing(history_db.connect()) as conn:
+        for user_id, refresh_token in history_db.refresh_tokens(conn):
+            if users and user_id not in users:
+                continue
+            attempted += 1
+            start = time.perf_counter()
+            try:
+                # Nobody is waiting on these, let them queue longer for the request budget
+                with rate_limit.priority(rate_limit.BACKGROUND):
+                    snapshot = sync_user(conn, oauth, user_id, refresh_token)
+            except Exception:
+                log.exception("sync failed for %s", user_id)
+                continue
+            synced += 1
+            log.info("synced %s in %.1fs (%d sources, %d results)", user_id, time.perf_counter() - start,
+                     len(snapshot['sources']), len(snapshot['results']))
+    return attempted, synced
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='sync every user once and exit (e.g. from cron)')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL, help='seconds between passes')
+    parser.add_argument('--user', action='append', dest='users', help='only sync this user id (repeatable)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    # httpx logs every request at INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    if args.interval >= history_db.SNAPSHOT_MAX_AGE:
+        log.warning("--interval %ds is longer than SNAPSHOT_MAX_AGE, snapshots will go stale between passes",
+                    args.interval)
+
+    while True:
+        attempted, synced = sync_all(args.users)
+        if args.once:
+            # Failing for cron when users were due (or asked for) and not one of them synced
+            return 1 if (attempted or args.users) and not synced else 0
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+
+# How a user's top artists moved between two recordings of the same time range (see
+# history_db.record_top_artists). Only the two newest recordings are read, through the
+# (user_id, time_range, recorded_at) index, and compared as one pivoted frame.
+
+STATUS_NEW = 'new'
+STATUS_DROPPED = 'dropped'
+# Genres listed per time range, by size of their shift
+GENRE_SHIFTS = 10
+
+
+def recorded_times(conn, user_id, time_range, count=2):
+    # recorded_at of the newest `count` recordings, oldest first
+    rows = conn.execute(
+        """SELECT DISTINCT recorded_at FROM top_artists
+           WHERE user_id = ? AND time_range = ?
+           ORDER BY recorded_at DESC
+           LIMIT ?""",
+        (user_id, time_range, count)).fetchall()
+    return [row[0] for row in reversed(rows)]
+
+
+def load_ranks(conn, user_id, time_range, times):
+    df = pd.read_sql_query(
+        f"""SELECT recorded_at, rank, artist_id, artist_name
+            FROM top_artists
+            WHERE user_id = ? AND time_range = ? AND recorded_at IN ({', '.join('?' * len(times))})""",
+        conn, params=(user_id, time_range, *times))
+    # Rows recorded before artist ids were stored are matched by name
+    df['artist_key'] = df['artist_id'].fillna(df['artist_name'])
+    return df
+
+
+def rank_changes(ranks, latest, previous=None):
+    """One row per artist in either recording: Artist, Rank, Previous Rank, Change (places climbed)
+    and Status ('new', 'dropped', 'up', 'down' or 'same'), current top artists first."""
+    # min, in case an artist is listed twice in one recording
+    wide = ranks.pivot_table(index='artist_key', columns='recorded_at', values='rank', aggfunc='min')
+    rank = wide[latest]
+    previous_rank = wide[previous] if previous else pd.Series(np.nan, index=wide.index)
+    change = previous_rank - rank
+    status = np.select(
+        [previous_rank.isna(), rank.isna(), change > 0, change < 0],
+        [STATUS_NEW, STATUS_DROPPED, 'up', 'down'], 'same')
+
+    # Newest name of every artist
+    names = ranks.sort_values('recorded_at').drop_duplicates('artist_key', keep='last').set_index('artist_key')
+    changes = pd.DataFrame({
+        'artist_id': names['artist_id'].reindex(wide.index),
+        'Artist': names['artist_name'].reindex(wide.index),
+        'Rank': rank.astype('Int64'),
+        'Previous Rank': previous_rank.astype('Int64'),
+        'Change': change.astype('Int64'),
+        'Status': status,
+    }, index=wide.index)
+    return changes.sort_values(['Rank', 'Previous Rank'], na_position='last').reset_index(drop=True)
+
+
+def genre_shares(ranks, artist_genres):
+    """Share of each recording's artists having each genre, genres x recorded_at.
+    artist_genres maps artist id -> list of genres (ArtistResolver.genres)."""
+    genres = ranks[['recorded_at', 'artist_id']].assign(genre=ranks['artist_id'].map(artist_genres))
+    genres = genres.explode('genre').dropna(subset=['genre'])
+    counts = pd.crosstab(genres['genre'], genres['recorded_at'])
+    artists = ranks.groupby('recorded_at').size()
+    return counts.div(artists.reindex(counts.columns), axis='columns')
+
+
+def genre_shifts(shares, latest, previous, limit=GENRE_SHIFTS):
+    # Genre, Share (now), Shift (share points gained since previous), the biggest moves first
+    shares = shares.reindex(columns=[previous, latest], fill_value=0.0)
+    shift = shares[latest] - shares[previous]
+    shifts = pd.DataFrame({'Genre': shares.index, 'Share': shares[latest].to_numpy(), 'Shift': shift.to_numpy()})
+    shifts = shifts[shifts['Shift'] != 0]
+    order = np.argsort(-shifts['Shift'].abs().to_numpy(), kind='stable')[:limit]
+    return shifts.iloc[order].reset_index(drop=True)
+
+
+def drift(conn, user_id, time_range, genres):
+    """Latest and previous recording times, rank changes and genre shifts for one time range, or None
+    when it was never recorded. genres(artist_ids) returns artist id -> genres for the shifts."""
+    times = recorded_times(conn, user_id, time_range)
+    if not times:
+        return None
+    latest = times[-1]
+    previous = times[0] if len(times) > 1 else None
+    ranks = load_ranks(conn, user_id, time_range, times)
+
+    changes = rank_changes(ranks, latest, previous)
+    shifts = None
+    if previous:
+        shares = genre_shares(ranks, genres(ranks['artist_id'].dropna().unique()))
+        shifts = genre_shifts(shares, latest, previous)
+    return {
+        'latest': latest,
+        'previous': previous,
+        'changes': changes,
+        'entered': changes.loc[changes['Status'] == STATUS_NEW, 'Artist'].tolist() if previous else [],
+        'dropped': changes.loc[changes['Status'] == STATUS_DROPPED, 'Artist'].tolist(),
+        'genres': shifts,
+    }
@@ -0,0 +1,29 @@
+import pandas as pd
+
+
+# Spotify's ISO-8601 UTC timestamps, once padded to always carry milliseconds
+SPOTIFY_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# Same order as SQLite's strftime('%w')
+DAY_NAMES = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+
+def parse_timestamps(values):
+    """Parse a column of Spotify timestamps (added_at, played_at), with or without milliseconds,
+    in one vectorized pass. Returns UTC datetimes, NaT where a value couldn't be parsed."""
+    values = pd.Series(values, dtype=object)
+    has_ms = values.str.contains('.', regex=False, na=True)
+    values = values.where(has_ms, values.str[:-1] + '.000Z')
+    return pd.to_datetime(values, format=SPOTIFY_FORMAT, utc=True, errors='coerce')
+
+
+def time_parts(timestamps):
+    """Hour and weekday of parsed timestamps as categoricals (every hour / day is a category,
+    so counts include the empty ones), plus the month as 'YYYY-MM'."""
+    timestamps = timestamps.dropna()
+    return pd.DataFrame({
+        'hour': pd.Categorical(timestamps.dt.hour, categories=range(24)),
+        # pandas counts weekdays from Monday
+        'weekday': pd.Categorical.from_codes((timestamps.dt.weekday.to_numpy() + 1) % 7, categories=DAY_NAMES),
+        'month': timestamps.dt.strftime('%Y-%m'),
+    }, index=timestamps.index)